@@ -17,225 +17,65 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+
 """ Heliotherm heat pump KNX gateway main application. """
 
 import argparse
 import asyncio
-import datetime as dt
+import importlib
+import importlib.util
 import logging
 import logging.config
 import os
 import sys
 import textwrap
-from typing import Any, Dict, Optional, Type
-
-from htheatpump import AioHtHeatpump
-from xknx import XKNX
-from xknx.devices import Notification
+import time
+from typing import Dict, List, Optional, Tuple, Type
 
 from .__version__ import __version__
-from .config import CONF_SYNCHRONIZE_CLOCK_TIME, CONF_SYNCHRONIZE_CLOCK_WEEKDAY, Config
-from .config_validation import WEEKDAYS
-from .htdatapoint import HtDataPoint
-from .htfaultnotification import HtFaultNotification
 
 _LOGGER = logging.getLogger(__name__)
 
 
-DEFAULT_LOGIN_INTERVAL = dt.timedelta(seconds=30)
-
-
-class HtPublisher:
-    """Class for periodically updating and publishing Heliotherm heat pump data points."""
-
-    def __init__(
-        self,
-        hthp: AioHtHeatpump,
-        data_points: Dict[str, HtDataPoint],
-        notifications: Dict[str, Type[Notification]],
-        update_interval: dt.timedelta,
-        cyclic_sending_interval: dt.timedelta,
-        synchronize_clock_weekly: Optional[Dict[str, Any]],
-    ):
-        """Initialize the HtPublisher class."""
-        self._hthp = hthp
-        self._data_points = data_points
-        self._notifications = notifications
-        self._update_interval = update_interval
-        self._cyclic_sending_interval = cyclic_sending_interval
-        self._synchronize_clock_weekly = synchronize_clock_weekly
-        self._login_task: Optional[asyncio.Task] = None
-        self._update_task: Optional[asyncio.Task] = None
-        self._cyclic_sending_task: Optional[asyncio.Task] = None
-        self._synchronize_clock_task: Optional[asyncio.Task] = None
-
-    def __del__(self):
-        """Destructor, cleaning up if this was not done before."""
-        self.stop()
-
-    def start(self) -> None:
-        """Start the HtPublisher."""
-        if self._login_task is None:
-            self._login_task = self._create_login_task(DEFAULT_LOGIN_INTERVAL)
-        if self._update_task is None:
-            self._update_task = self._create_update_task(self._update_interval)
-        if self._cyclic_sending_task is None:
-            self._cyclic_sending_task = self._create_cyclic_sending_task(
-                self._cyclic_sending_interval
-            )
-        if self._synchronize_clock_task is None:
-            self._synchronize_clock_task = self._create_synchronize_clock_task(
-                self._synchronize_clock_weekly
-            )
-
-    def stop(self) -> None:
-        """Stop the HtPublisher."""
-        if self._login_task is not None:
-            self._login_task.cancel()
-            self._login_task = None
-        if self._update_task is not None:
-            self._update_task.cancel()
-            self._update_task = None
-        if self._cyclic_sending_task is not None:
-            self._cyclic_sending_task.cancel()
-            self._cyclic_sending_task = None
-        if self._synchronize_clock_task is not None:
-            self._synchronize_clock_task.cancel()
-            self._synchronize_clock_task = None
-
-    def __enter__(self) -> "HtPublisher":
-        """Start the HtPublisher from context manager."""
-        self.start()
-        return self
-
-    def __exit__(self, exc_type, exc_value, traceback) -> None:
-        """Stop the HtPublisher from context manager."""
-        self.stop()
-
-    def _create_login_task(
-        self, login_interval: dt.timedelta
-    ) -> Optional[asyncio.Task]:
-        """Create an asyncio.Task to periodically login to the heat pump."""
-
-        async def login_loop(self, login_interval: dt.timedelta):
-            """Endless loop to periodically login to the heat pump."""
-            while True:
-                _LOGGER.info("<<< [ LOGIN (every %s) ] >>>", login_interval)
-                try:
-                    await self._hthp.login_async()
-                except Exception as ex:
-                    _LOGGER.exception(ex)
-                # wait until next run
-                await asyncio.sleep(login_interval.total_seconds())
-
-        if login_interval.total_seconds() > 0:
-            loop = asyncio.get_event_loop()
-            return loop.create_task(login_loop(self, login_interval=login_interval))
-        return None
-
-    def _create_update_task(
-        self, update_interval: dt.timedelta
-    ) -> Optional[asyncio.Task]:
-        """Create an asyncio.Task for updating the heat pump parameter values periodically."""
-
-        async def update_loop(self, update_interval: dt.timedelta):
-            """Endless loop for updating the heat pump parameter values."""
-            while True:
-                _LOGGER.info("<<< [ UPDATE (every %s) ] >>>", update_interval)
-                # check for notifications
-                for notif in self._notifications.values():
-                    await notif.do()
-                # update the data point values
-                try:
-                    params = await self._hthp.query_async(*self._data_points.keys())
-                    _LOGGER.info("Update: %s", params)
-                    for name, value in params.items():
-                        await self._data_points[name].set(value)
-                except Exception as ex:
-                    _LOGGER.exception(ex)
-                # wait until next run
-                await asyncio.sleep(update_interval.total_seconds())
-
-        if update_interval.total_seconds() > 0:
-            loop = asyncio.get_event_loop()
-            return loop.create_task(update_loop(self, update_interval=update_interval))
-        return None
-
-    def _create_cyclic_sending_task(
-        self, cyclic_sending_interval: dt.timedelta
-    ) -> Optional[asyncio.Task]:
-        """Create an asyncio.Task for sending the heat pump parameter values periodically to the KNX bus."""
-
-        async def cyclic_sending_loop(self, cyclic_sending_interval: dt.timedelta):
-            """Endless loop for sending the heat pump parameter values to the KNX bus."""
-            while True:
-                _LOGGER.info(
-                    "<<< [ CYCLIC SENDING (every %s) ] >>>", cyclic_sending_interval
-                )
-                _LOGGER.info(
-                    "Sending: %s",
-                    [
-                        name
-                        for name, dp in self._data_points.items()
-                        if dp.cyclic_sending
-                    ],
-                )
-                # broadcast the data point values to the KNX bus
-                for dp in self._data_points.values():
-                    await dp.broadcast_value()
-                # wait until next run
-                await asyncio.sleep(cyclic_sending_interval.total_seconds())
-
-        if cyclic_sending_interval.total_seconds() > 0:
-            loop = asyncio.get_event_loop()
-            return loop.create_task(
-                cyclic_sending_loop(
-                    self, cyclic_sending_interval=cyclic_sending_interval
-                )
-            )
-        return None
-
-    def _create_synchronize_clock_task(
-        self, synchronize_clock_weekly: Optional[Dict[str, Any]]
-    ) -> Optional[asyncio.Task]:
-        """Create an asyncio.Task to synchronize the clock of the heat pump regularly."""
-
-        async def synchronize_clock_loop(
-            self, synchronize_clock_weekly: Dict[str, Any]
-        ):
-            """Endless loop to synchronize the clock of the heat pump regularly."""
-            sync_weekday = synchronize_clock_weekly[CONF_SYNCHRONIZE_CLOCK_WEEKDAY]
-            sync_time = synchronize_clock_weekly[CONF_SYNCHRONIZE_CLOCK_TIME]
-            while True:
-                # wait for the next run (once a day)
-                now = dt.datetime.now()
-                delay = dt.datetime.combine(now.date(), sync_time) - now
-                if delay.total_seconds() < 0:
-                    delay += dt.timedelta(days=1)
-                await asyncio.sleep(delay.total_seconds())
-
-                # synchronize the clock only on the defined weekday
-                if now.weekday() == WEEKDAYS.index(sync_weekday):
-                    _LOGGER.info(
-                        "<<< [ SYNCHRONIZE CLOCK (weekly on '%s' at %s) ] >>>",
-                        sync_weekday,
-                        sync_time.strftime("%H:%M:%S"),
-                    )
-                    try:
-                        # set the current date and time of the heat pump
-                        hthp_dt, _ = await self._hthp.set_date_time_async()
-                        _LOGGER.debug(hthp_dt.isoformat())
-                    except Exception as ex:
-                        _LOGGER.exception(ex)
-
-        if synchronize_clock_weekly is not None:
-            loop = asyncio.get_event_loop()
-            return loop.create_task(
-                synchronize_clock_loop(
-                    self, synchronize_clock_weekly=synchronize_clock_weekly
-                )
-            )
-        return None
+# the (heavy) modules are imported on demand, to keep the start of the command line interface
+# fast: the modules needed to read the gateway settings and the ones of the gateway (yaml,
+# voluptuous, xknx and htheatpump are only imported by the validation of the settings if the
+# validated settings aren't read from the cache)
+CONFIG_MODULES = (".config",)
+GATEWAY_MODULES = (
+    "htheatpump",
+    "xknx",
+    ".htrequestbroker",
+    ".htdatapoint",
+    ".htfaultnotification",
+    ".htpublisher",
+    ".state",
+    ".telegramrouter",
+    ".metrics",
+)
+
+# time in seconds it took to import the modules loaded on demand
+_import_times: List[Tuple[str, float]] = []
+
+
+def _import(*names: str) -> None:
+    """Import the given modules (if not already done) and record the time it took."""
+    for name in names:
+        if importlib.util.resolve_name(name, __package__) in sys.modules:
+            continue
+        start = time.perf_counter()
+        importlib.import_module(name, __package__)
+        _import_times.append((name, time.perf_counter() - start))
+
+
+def _print_import_times() -> None:
+    """Print the time it took to import the modules loaded on demand (like ``-X importtime``)."""
+    print("import time: cumulative [us] | module", file=sys.stderr)
+    for name, duration in _import_times:
+        print(
+            "import time: {:>15d} | {}".format(round(duration * 1e6), name),
+            file=sys.stderr,
+        )
 
 
 async def main_async() -> None:
@@ -280,6 +120,28 @@ async def main_async() -> None:
         help="the filename under which the logging configuration can be found, default: %(default)s",
     )
 
+    parser.add_argument(
+        "--config-cache",
+        type=str,
+        help="the filename under which the validated gateway settings are cached,"
+        " default: '.<config_file>.cache' in the directory of the config file",
+    )
+    parser.add_argument(
+        "--no-config-cache",
+        action="store_true",
+        help="don't cache the validated gateway settings",
+    )
+    parser.add_argument(
+        "--check-config",
+        action="store_true",
+        help="only read and validate the gateway settings and exit",
+    )
+    parser.add_argument(
+        "--import-time",
+        action="store_true",
+        help="print the time it took to import the modules loaded on demand",
+    )
+
     # parse the passed arguments
     args = parser.parse_args()
     print(args)
@@ -293,11 +155,20 @@ async def main_async() -> None:
         )
         sys.exit(1)
 
+    _import(*CONFIG_MODULES)
+    from .config import CONF_FILE, CONF_SAVE_INTERVAL, CONF_SESSION_TIMEOUT, Config
+
     try:
         # load the settings from the config file
         config = Config()
         _LOGGER.info("Load settings from '%s'.", args.config_file)
-        config.read(args.config_file)
+        cache_file = args.config_cache
+        if cache_file is None:
+            cache_file = os.path.join(
+                os.path.dirname(args.config_file),
+                ".{}.cache".format(os.path.basename(args.config_file)),
+            )
+        config.read(args.config_file, None if args.no_config_cache else cache_file)
         _LOGGER.debug("Config: %s", config.__dict__)
     except Exception as ex:
         _LOGGER.error(
@@ -305,18 +176,53 @@ async def main_async() -> None:
         )
         sys.exit(1)
 
+    if args.check_config:
+        if args.import_time:
+            _print_import_times()
+        _LOGGER.info("Gateway config file '%s' is valid.", args.config_file)
+        sys.exit(0)
+
+    _import(*GATEWAY_MODULES)
+    from htheatpump import AioHtHeatpump
+    from xknx import XKNX
+    from xknx.devices import Notification
+
+    from . import metrics
+    from .htdatapoint import HtDataPoint
+    from .htfaultnotification import HtFaultNotification
+    from .htpublisher import HtPublisher
+    from .htrequestbroker import HtRequestBroker
+    from .state import StateStore
+    from .telegramrouter import TelegramRouter
+
+    if args.import_time:
+        _print_import_times()
+
     _LOGGER.info("Start Heliotherm heat pump KNX gateway v%s.", __version__)
+    metrics_server: Optional[metrics.MetricsServer] = None
+    state_store: Optional[StateStore] = None
     try:
         # create objects to establish connection to the heat pump and the KNX bus
-        hthp = AioHtHeatpump(**config.heat_pump)
+        heat_pump_conf = dict(config.heat_pump)
+        session_timeout = heat_pump_conf.pop(CONF_SESSION_TIMEOUT)
+        hthp = AioHtHeatpump(**heat_pump_conf)
         xknx = XKNX(**config.knx)
+        # incoming telegrams are dispatched by an index of the used group addresses
+        router = TelegramRouter()
+        xknx.devices = router
+
+        # all further requests to the heat pump are going through the request broker
+        # (which also logs in to the heat pump on demand, if the session has expired)
+        broker = HtRequestBroker(hthp, session_timeout.total_seconds())
 
         group_addresses: Dict[str, str] = {}
 
         # create data points
         data_points: Dict[str, HtDataPoint] = {}
         for dp_name, dp_conf in config.data_points.items():
-            data_points[dp_name] = HtDataPoint.from_config(xknx, hthp, dp_name, dp_conf)
+            data_points[dp_name] = HtDataPoint.from_config(
+                xknx, broker, dp_name, dp_conf
+            )
             _LOGGER.debug("DP: %s", data_points[dp_name])
             ga = str(data_points[dp_name].group_address)
             if ga in group_addresses:
@@ -325,41 +231,91 @@ async def main_async() -> None:
                     f" {ga!r} ({group_addresses[ga]!r} and {dp_name!r})"
                 )
             group_addresses[ga] = dp_name
+            router.route(data_points[dp_name].group_address, data_points[dp_name])
 
         # create notifications
         notifications: Dict[str, Type[Notification]] = {}
         for notif_name, notif_conf in config.notifications.items():
             if notif_name == "on_malfunction":
                 notifications[notif_name] = HtFaultNotification.from_config(
-                    xknx, hthp, notif_name, notif_conf
+                    xknx, broker, notif_name, notif_conf
                 )
                 _LOGGER.debug("NOTIF: %s", notifications[notif_name])
             else:
                 _LOGGER.warning("Invalid notification '%s'", notif_name)
                 # assert 0, "Invalid notification"
-            ga = str(notifications[notif_name].group_address)
-            if ga in group_addresses:
-                raise RuntimeError(
-                    "Multiple use of the same KNX group address"
-                    f" {ga!r} ({group_addresses[ga]!r} and {notif_name!r})"
-                )
-            group_addresses[ga] = notif_name
-
-        # open the connection to the Heliotherm heat pump and login
-        hthp.open_connection()
-        await hthp.login_async()
-        rid = await hthp.get_serial_number_async()
-        _LOGGER.info("Connected successfully to heat pump with serial number %d.", rid)
-        ver = await hthp.get_version_async()
-        _LOGGER.info("Software version = %s (%d)", *ver)
-
-        # start the KNX module which connects to the KNX/IP gateway
-        await xknx.start()
-
-        # create and start the publisher
-        with HtPublisher(hthp, data_points, notifications, **config.general):
-            # Wait until Ctrl-C was pressed
-            await xknx.loop_until_sigint()
+            for addr in notifications[notif_name].group_addresses:
+                ga = str(addr)
+                if ga in group_addresses:
+                    raise RuntimeError(
+                        "Multiple use of the same KNX group address"
+                        f" {ga!r} ({group_addresses[ga]!r} and {notif_name!r})"
+                    )
+                group_addresses[ga] = notif_name
+                router.route(addr, notifications[notif_name])
+
+        # restore the state of the data points of the last run (warm start)
+        if config.state is not None:
+            state_store = StateStore(
+                config.state[CONF_FILE], data_points, config.state[CONF_SAVE_INTERVAL]
+            )
+            state_store.load()
+
+        async def connect_heat_pump() -> None:
+            """Open the connection to the Heliotherm heat pump and login."""
+            hthp.open_connection()
+            await hthp.login_async()
+            rid = await hthp.get_serial_number_async()
+            _LOGGER.info(
+                "Connected successfully to heat pump with serial number %d.", rid
+            )
+            ver = await hthp.get_version_async()
+            _LOGGER.info("Software version = %s (%d)", *ver)
+            _LOGGER.info(
+                "Startup: heat pump connection established after %.3fs",
+                loop.time() - startup_time,
+            )
+
+        # both connections are set up concurrently
+        loop = asyncio.get_event_loop()
+        startup_time = loop.time()
+        heat_pump_setup = loop.create_task(connect_heat_pump())
+        try:
+            # start the KNX module which connects to the KNX/IP gateway
+            await xknx.start()
+            _LOGGER.info(
+                "Startup: KNX connection established after %.3fs",
+                loop.time() - startup_time,
+            )
+
+            # start the (optional) metrics endpoint
+            if config.metrics is not None:
+                metrics_server = metrics.MetricsServer(**config.metrics)
+                await metrics_server.start()
+
+            # persist the state of the data points periodically
+            if state_store is not None:
+                state_store.start()
+
+            # create and start the publisher as soon as the KNX side is up, so the cached
+            # values are served (the queries are queued until the request broker is started)
+            with HtPublisher(broker, data_points, notifications, **config.general):
+                await heat_pump_setup
+                # start the request broker
+                with broker:
+                    _LOGGER.info(
+                        "Startup: gateway ready after %.3fs", loop.time() - startup_time
+                    )
+                    # Wait until Ctrl-C was pressed
+                    await xknx.loop_until_sigint()
+        finally:
+            heat_pump_setup.cancel()
+
+        if state_store is not None:
+            state_store.stop()
+        if metrics_server is not None:
+            await metrics_server.stop()
+        _LOGGER.info("Telegram router stats: %s", router.stats)
 
         # stop the KNX module
         await xknx.stop()
@@ -21,16 +21,9 @@
 
 import logging
 from datetime import timedelta
-from typing import Any, Callable, Dict
+from typing import Any, Dict, Optional
 
-import voluptuous as vol
-import yaml
-from htheatpump.htparams import HtParams
-from xknx import XKNX
-from xknx.io import ConnectionConfig, ConnectionType
-from xknx.telegram import IndividualAddress
-
-from . import config_validation as cv
+from . import configcache
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -38,15 +31,26 @@ _LOGGER = logging.getLogger(__name__)
 CONF_GENERAL = "general"
 CONF_UPDATE_INTERVAL = "update_interval"
 CONF_CYCLIC_SENDING_INTERVAL = "cyclic_sending_interval"
+CONF_CYCLIC_SENDING_OFFSET = "cyclic_sending_offset"
+CONF_STAGGER_CYCLIC_SENDING = "stagger_cyclic_sending"
 CONF_SYNCHRONIZE_CLOCK_WEEKLY = "synchronize_clock_weekly"
 CONF_SYNCHRONIZE_CLOCK_WEEKDAY = "weekday"
 CONF_SYNCHRONIZE_CLOCK_TIME = "time"
+CONF_ADAPTIVE_UPDATE = "adaptive_update"
+CONF_MIN_INTERVAL = "min_interval"
+CONF_MAX_INTERVAL = "max_interval"
+CONF_FAST_QUERY = "fast_query"
+CONF_TARGET_UTILIZATION = "target_utilization"
 
 CONF_HEAT_PUMP = "heat_pump"
 CONF_DEVICE = "device"
 CONF_BAUDRATE = "baudrate"
+CONF_SESSION_TIMEOUT = "session_timeout"
 
 CONF_KNX = "knx"
+CONF_CONNECTION_TYPE = "connection_type"
+CONF_MULTICAST_GROUP = "multicast_group"
+CONF_MULTICAST_PORT = "multicast_port"
 CONF_GATEWAY_IP = "gateway_ip"
 CONF_GATEWAY_PORT = "gateway_port"
 CONF_AUTO_RECONNECT = "auto_reconnect"
@@ -63,191 +67,48 @@ CONF_CYCLIC_SENDING = "cyclic_sending"
 CONF_SEND_ON_CHANGE = "send_on_change"
 CONF_ON_CHANGE_OF_ABSOLUTE = "on_change_of_absolute"
 CONF_ON_CHANGE_OF_RELATIVE = "on_change_of_relative"
+CONF_MIN_SEND_INTERVAL = "min_send_interval"
+CONF_MAX_SILENCE = "max_silence"
+CONF_HYSTERESIS = "hysteresis"
+CONF_COMPARE_PAYLOAD = "compare_payload"
+CONF_MAX_AGE = "max_age"
+CONF_WRITE_DEBOUNCE = "write_debounce"
 
 CONF_NOTIFICATIONS = "notifications"
 CONF_ON_MALFUNCTION = "on_malfunction"
 CONF_REPEAT_AFTER = "repeat_after"
+CONF_FAULT_LOG_SIZE = "fault_log_size"
+CONF_FAULT_COUNT_GROUP_ADDRESS = "fault_count_group_address"
+CONF_FAULT_INDEX_GROUP_ADDRESS = "fault_index_group_address"
+
+CONF_STATE = "state"
+CONF_FILE = "file"
+CONF_SAVE_INTERVAL = "save_interval"
+
+CONF_METRICS = "metrics"
+CONF_HOST = "host"
+CONF_PORT = "port"
 
 
 DEFAULT_UPDATE_INTERVAL = 60
+DEFAULT_TARGET_UTILIZATION = 0.5
 DEFAULT_CYCLIC_SENDING_INTERVAL = 600
+DEFAULT_CYCLIC_SENDING_OFFSET = 0
 DEFAULT_BAUDRATE = 115200
+DEFAULT_SESSION_TIMEOUT = 30
 DEFAULT_GATEWAY_PORT = 3671
+DEFAULT_MULTICAST_GROUP = "224.0.23.12"
+DEFAULT_MULTICAST_PORT = 3671
 DEFAULT_AUTO_RECONNECT_WAIT = 3
 DEFAULT_RATE_LIMIT = 10  # XKNX.DEFAULT_RATE_LIMIT
+DEFAULT_OWN_ADDRESS = "15.15.250"  # XKNX.DEFAULT_ADDRESS
+DEFAULT_FAULT_LOG_SIZE = 10
+DEFAULT_STATE_SAVE_INTERVAL = 60
+DEFAULT_METRICS_HOST = "127.0.0.1"
+DEFAULT_METRICS_PORT = 9100
 
-
-SYNCHRONIZE_CLOCK_WEEKLY_SCHEMA = vol.Schema(
-    {
-        CONF_SYNCHRONIZE_CLOCK_WEEKDAY: vol.All(cv.string, vol.In(cv.WEEKDAYS)),
-        CONF_SYNCHRONIZE_CLOCK_TIME: cv.time,
-    }
-)
-
-GENERAL_SCHEMA = vol.Schema(
-    {
-        vol.Optional(
-            CONF_UPDATE_INTERVAL, default=DEFAULT_UPDATE_INTERVAL
-        ): cv.time_interval,
-        vol.Optional(
-            CONF_CYCLIC_SENDING_INTERVAL, default=DEFAULT_CYCLIC_SENDING_INTERVAL
-        ): cv.time_interval,
-        vol.Optional(CONF_SYNCHRONIZE_CLOCK_WEEKLY): SYNCHRONIZE_CLOCK_WEEKLY_SCHEMA,
-    }
-)
-
-HEAT_PUMP_SCHEMA = vol.Schema(
-    {
-        vol.Required(CONF_DEVICE): cv.string,
-        vol.Optional(CONF_BAUDRATE, default=DEFAULT_BAUDRATE): vol.All(
-            vol.Coerce(int), vol.In([9600, 19200, 38400, 57600, 115200])
-        ),
-    }
-)
-
-KNX_SCHEMA = vol.Schema(
-    {
-        vol.Required(CONF_GATEWAY_IP): cv.string,
-        vol.Optional(CONF_GATEWAY_PORT, default=DEFAULT_GATEWAY_PORT): cv.port,
-        vol.Optional(CONF_AUTO_RECONNECT, default=True): cv.boolean,
-        vol.Optional(
-            CONF_AUTO_RECONNECT_WAIT, default=DEFAULT_AUTO_RECONNECT_WAIT
-        ): cv.time_interval,
-        vol.Optional(CONF_LOCAL_IP): cv.string,
-        vol.Optional(
-            CONF_OWN_ADDRESS, default=XKNX.DEFAULT_ADDRESS
-        ): cv.ensure_individual_address,
-        vol.Optional(CONF_RATE_LIMIT, default=DEFAULT_RATE_LIMIT): vol.All(
-            vol.Coerce(int), vol.Range(min=0, max=100)
-        ),
-    }
-)
-
-
-def validate_data_point() -> Callable:
-    """Ensure that the data point is valid."""
-
-    def validate(obj: Dict) -> Dict:
-        if (
-            obj[CONF_VALUE_TYPE] == "binary"
-            and len({CONF_ON_CHANGE_OF_ABSOLUTE, CONF_ON_CHANGE_OF_RELATIVE} & set(obj))
-            > 0
-        ):
-            raise vol.Invalid(
-                "{} not allowed for binary data point".format(
-                    ", ".join((CONF_ON_CHANGE_OF_ABSOLUTE, CONF_ON_CHANGE_OF_RELATIVE))
-                )
-            )
-        if (
-            obj[CONF_VALUE_TYPE] != "binary"
-            and obj[CONF_SEND_ON_CHANGE]
-            and len({CONF_ON_CHANGE_OF_ABSOLUTE, CONF_ON_CHANGE_OF_RELATIVE} & set(obj))
-            < 1
-        ):
-            raise vol.Invalid(
-                "must contain at least one of {}".format(
-                    ", ".join((CONF_ON_CHANGE_OF_ABSOLUTE, CONF_ON_CHANGE_OF_RELATIVE))
-                )
-            )
-
-        return obj
-
-    return validate
-
-
-DATA_POINT_SCHEMA = vol.All(
-    dict,
-    vol.Schema(
-        {
-            vol.Required(CONF_VALUE_TYPE): vol.Or(cv.ensure_knx_dpt, "binary"),
-            vol.Required(CONF_GROUP_ADDRESS): cv.ensure_group_address,
-            vol.Optional(CONF_WRITABLE, default=False): cv.boolean,
-            vol.Optional(CONF_CYCLIC_SENDING, default=False): cv.boolean,
-            vol.Optional(CONF_SEND_ON_CHANGE, default=False): cv.boolean,
-            vol.Exclusive(
-                CONF_ON_CHANGE_OF_ABSOLUTE,
-                "on_change_of",
-                msg="absolute or relative change",
-            ): cv.number_greater_zero,
-            vol.Exclusive(
-                CONF_ON_CHANGE_OF_RELATIVE,
-                "on_change_of",
-                msg="absolute or relative change",
-            ): cv.number_greater_zero,
-        }
-    ),
-    validate_data_point(),
-)
-
-
-def check_for_valid_parameter_names() -> Callable:
-    """Check for valid parameter names in the data points section."""
-
-    def validate(obj: Dict) -> Dict:
-        for name in obj.keys():
-            if name not in HtParams.keys():
-                raise vol.Invalid(f"{name!r} is not a valid heat pump parameter")
-
-        return obj
-
-    return validate
-
-
-def check_for_warnings_in_data_points() -> Callable:
-    """Check for warnings in the data point config section."""
-
-    def validate(obj: Dict) -> Dict:
-        for name, dp in obj.items():
-            if (
-                dp[CONF_VALUE_TYPE] != "binary"
-                and not dp[CONF_SEND_ON_CHANGE]
-                and len(
-                    {CONF_ON_CHANGE_OF_ABSOLUTE, CONF_ON_CHANGE_OF_RELATIVE} & set(dp)
-                )
-                > 0
-            ):
-                _LOGGER.warning(
-                    "%s is defined, but %s is set to false for data point '%s'",
-                    CONF_ON_CHANGE_OF_ABSOLUTE
-                    if CONF_ON_CHANGE_OF_ABSOLUTE in dp
-                    else CONF_ON_CHANGE_OF_RELATIVE,
-                    CONF_SEND_ON_CHANGE,
-                    name,
-                )
-
-        return obj
-
-    return validate
-
-
-DATA_POINTS_SCHEMA = vol.All(
-    dict,
-    vol.Schema({cv.string: DATA_POINT_SCHEMA}),
-    check_for_valid_parameter_names(),
-    check_for_warnings_in_data_points(),
-)
-
-NOTIFICATION_SCHEMA = vol.Schema(
-    {vol.Required(CONF_GROUP_ADDRESS): cv.ensure_group_address}
-)
-
-ON_MALFUNCTION_SCHEMA = NOTIFICATION_SCHEMA.extend(
-    {
-        vol.Optional(CONF_REPEAT_AFTER, default=None): vol.Or(cv.time_interval, None),
-    }
-)
-
-NOTIFICATIONS_SCHEMA = vol.Schema({CONF_ON_MALFUNCTION: ON_MALFUNCTION_SCHEMA})
-
-CONFIG_SCHEMA = vol.Schema(
-    {
-        vol.Optional(CONF_GENERAL): GENERAL_SCHEMA,
-        CONF_HEAT_PUMP: HEAT_PUMP_SCHEMA,
-        CONF_KNX: KNX_SCHEMA,
-        vol.Optional(CONF_DATA_POINTS): DATA_POINTS_SCHEMA,
-        vol.Optional(CONF_NOTIFICATIONS): NOTIFICATIONS_SCHEMA,
-    }
-)
+# value of the general update interval to tune it automatically
+AUTO_UPDATE_INTERVAL = "auto"
 
 
 class Config:
@@ -258,37 +119,64 @@ class Config:
         self.general: Dict[str, Any] = {
             CONF_UPDATE_INTERVAL: timedelta(DEFAULT_UPDATE_INTERVAL),
             CONF_CYCLIC_SENDING_INTERVAL: timedelta(DEFAULT_CYCLIC_SENDING_INTERVAL),
+            CONF_CYCLIC_SENDING_OFFSET: timedelta(
+                seconds=DEFAULT_CYCLIC_SENDING_OFFSET
+            ),
+            CONF_STAGGER_CYCLIC_SENDING: False,
             CONF_SYNCHRONIZE_CLOCK_WEEKLY: None,
+            CONF_ADAPTIVE_UPDATE: None,
+            CONF_FAST_QUERY: True,
+            CONF_TARGET_UTILIZATION: DEFAULT_TARGET_UTILIZATION,
         }
         self.heat_pump: Dict[str, Any] = {
             CONF_DEVICE: None,
             CONF_BAUDRATE: DEFAULT_BAUDRATE,
+            CONF_SESSION_TIMEOUT: timedelta(seconds=DEFAULT_SESSION_TIMEOUT),
         }
-        self.knx: Dict[str, Any] = {
-            "connection_config": ConnectionConfig(
-                connection_type=ConnectionType.TUNNELING
-            ),
-            CONF_OWN_ADDRESS: IndividualAddress(XKNX.DEFAULT_ADDRESS),
-            CONF_RATE_LIMIT: DEFAULT_RATE_LIMIT,
-        }
+        # the XKNX objects of the KNX settings are only created on demand (see 'knx')
+        self._knx: Dict[str, Any] = {}
         self.data_points: Dict[str, dict] = {}
         self.notifications: Dict[str, dict] = {}
+        self.state: Optional[Dict[str, Any]] = None
+        self.metrics: Optional[Dict[str, Any]] = None
 
-    def read(self, filename: str = "htknx.yaml") -> None:
+    def read(
+        self, filename: str = "htknx.yaml", cache_file: Optional[str] = None
+    ) -> None:
         """Read the configuration from the given file.
 
+        If a cache file is given, the validated settings are stored in it and read from it
+        directly as long as the config file (and the versions of the used packages) are
+        unchanged, which skips the validation of the settings.
+
         :param filename: The filename to read the configuration from, e.g. 'htknx.yaml'.
         :type filename: str
+        :param cache_file: The filename of the cache of the validated settings (optional).
+        :type cache_file: str
         """
         # _LOGGER.debug("Reading config file '%s'.", filename)
-        with open(filename, "r") as f:
-            doc = yaml.safe_load(f)
-            doc = CONFIG_SCHEMA(doc)
-            self._parse_general_settings(doc)
-            self._parse_heat_pump_settings(doc)
-            self._parse_knx_settings(doc)
-            self._parse_data_points(doc)
-            self._parse_notifications(doc)
+        with open(filename, "rb") as f:
+            content = f.read()
+        doc = None
+        if cache_file is not None:
+            key = configcache.cache_key(content)
+            doc = configcache.read_cache(cache_file, key)
+        if doc is None:
+            # imported on demand, so they are not loaded if the cached settings are used
+            import yaml
+
+            from .config_schema import CONFIG_SCHEMA
+
+            doc = CONFIG_SCHEMA(yaml.safe_load(content))
+            if cache_file is not None:
+                configcache.write_cache(cache_file, key, doc)
+        self._parse_general_settings(doc)
+        self._parse_heat_pump_settings(doc)
+        self._parse_knx_settings(doc)
+        self._parse_data_points(doc)
+        self._parse_notifications(doc)
+        self._parse_state_settings(doc)
+        self._parse_metrics_settings(doc)
 
     def _parse_general_settings(self, doc) -> None:
         """Parse the general section of the config file."""
@@ -303,30 +191,48 @@ class Config:
     def _parse_knx_settings(self, doc) -> None:
         """Parse the KNX section of the config file."""
         if CONF_KNX in doc:
-            if CONF_GATEWAY_IP in doc[CONF_KNX]:
-                self.knx["connection_config"].gateway_ip = doc[CONF_KNX][
-                    CONF_GATEWAY_IP
-                ]
-            if CONF_GATEWAY_PORT in doc[CONF_KNX]:
-                self.knx["connection_config"].gateway_port = doc[CONF_KNX][
-                    CONF_GATEWAY_PORT
-                ]
-            if CONF_AUTO_RECONNECT in doc[CONF_KNX]:
-                self.knx["connection_config"].auto_reconnect = doc[CONF_KNX][
-                    CONF_AUTO_RECONNECT
-                ]
-            if CONF_AUTO_RECONNECT_WAIT in doc[CONF_KNX]:
-                self.knx["connection_config"].auto_reconnect_wait = doc[CONF_KNX][
-                    CONF_AUTO_RECONNECT_WAIT
-                ].total_seconds()
-            if CONF_LOCAL_IP in doc[CONF_KNX]:
-                self.knx["connection_config"].local_ip = doc[CONF_KNX][CONF_LOCAL_IP]
-            if CONF_OWN_ADDRESS in doc[CONF_KNX]:
-                self.knx[CONF_OWN_ADDRESS] = IndividualAddress(
-                    doc[CONF_KNX][CONF_OWN_ADDRESS]
-                )
-            if CONF_RATE_LIMIT in doc[CONF_KNX]:
-                self.knx[CONF_RATE_LIMIT] = doc[CONF_KNX][CONF_RATE_LIMIT]
+            self._knx.update(doc[CONF_KNX])
+
+    @property
+    def knx(self) -> Dict[str, Any]:
+        """Return the KNX settings as arguments for :class:`xknx.XKNX`.
+
+        The XKNX objects are created on each call, so XKNX is only imported if needed.
+        """
+        from xknx.io import ConnectionConfig, ConnectionType, GatewayScanFilter
+        from xknx.telegram import IndividualAddress
+
+        knx = self._knx
+        # the scan filter (for an automatic connection) depends on the connection type
+        connection_config = ConnectionConfig(
+            connection_type=ConnectionType[
+                knx.get(CONF_CONNECTION_TYPE, "tunneling").upper()
+            ],
+            scan_filter=GatewayScanFilter(),
+        )
+        if CONF_GATEWAY_IP in knx:
+            connection_config.gateway_ip = knx[CONF_GATEWAY_IP]
+        if CONF_GATEWAY_PORT in knx:
+            connection_config.gateway_port = knx[CONF_GATEWAY_PORT]
+        if CONF_AUTO_RECONNECT in knx:
+            connection_config.auto_reconnect = knx[CONF_AUTO_RECONNECT]
+        if CONF_AUTO_RECONNECT_WAIT in knx:
+            connection_config.auto_reconnect_wait = knx[
+                CONF_AUTO_RECONNECT_WAIT
+            ].total_seconds()
+        if CONF_LOCAL_IP in knx:
+            connection_config.local_ip = knx[CONF_LOCAL_IP]
+        return {
+            "connection_config": connection_config,
+            CONF_OWN_ADDRESS: IndividualAddress(
+                knx.get(CONF_OWN_ADDRESS, DEFAULT_OWN_ADDRESS)
+            ),
+            CONF_RATE_LIMIT: knx.get(CONF_RATE_LIMIT, DEFAULT_RATE_LIMIT),
+            CONF_MULTICAST_GROUP: knx.get(
+                CONF_MULTICAST_GROUP, DEFAULT_MULTICAST_GROUP
+            ),
+            CONF_MULTICAST_PORT: knx.get(CONF_MULTICAST_PORT, DEFAULT_MULTICAST_PORT),
+        }
 
     def _parse_data_points(self, doc) -> None:
         """Parse the data points section of the config file."""
@@ -337,3 +243,13 @@ class Config:
         """Parse the notifications section of the config file."""
         if CONF_NOTIFICATIONS in doc:
             self.notifications.update(doc[CONF_NOTIFICATIONS])
+
+    def _parse_state_settings(self, doc) -> None:
+        """Parse the state section of the config file."""
+        if CONF_STATE in doc:
+            self.state = dict(doc[CONF_STATE])
+
+    def _parse_metrics_settings(self, doc) -> None:
+        """Parse the metrics section of the config file."""
+        if CONF_METRICS in doc:
+            self.metrics = dict(doc[CONF_METRICS])
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Schema for the validation of the gateway settings. """
+
+import logging
+from typing import Callable, Dict
+
+import voluptuous as vol
+
+from . import config_validation as cv
+from .config import (
+    AUTO_UPDATE_INTERVAL,
+    CONF_ADAPTIVE_UPDATE,
+    CONF_AUTO_RECONNECT,
+    CONF_AUTO_RECONNECT_WAIT,
+    CONF_BAUDRATE,
+    CONF_COMPARE_PAYLOAD,
+    CONF_CONNECTION_TYPE,
+    CONF_CYCLIC_SENDING,
+    CONF_CYCLIC_SENDING_INTERVAL,
+    CONF_CYCLIC_SENDING_OFFSET,
+    CONF_DATA_POINTS,
+    CONF_DEVICE,
+    CONF_FAST_QUERY,
+    CONF_FAULT_COUNT_GROUP_ADDRESS,
+    CONF_FAULT_INDEX_GROUP_ADDRESS,
+    CONF_FAULT_LOG_SIZE,
+    CONF_FILE,
+    CONF_GATEWAY_IP,
+    CONF_GATEWAY_PORT,
+    CONF_GENERAL,
+    CONF_GROUP_ADDRESS,
+    CONF_HEAT_PUMP,
+    CONF_HOST,
+    CONF_HYSTERESIS,
+    CONF_KNX,
+    CONF_LOCAL_IP,
+    CONF_MAX_AGE,
+    CONF_MAX_INTERVAL,
+    CONF_MAX_SILENCE,
+    CONF_METRICS,
+    CONF_MIN_INTERVAL,
+    CONF_MIN_SEND_INTERVAL,
+    CONF_MULTICAST_GROUP,
+    CONF_MULTICAST_PORT,
+    CONF_NOTIFICATIONS,
+    CONF_ON_CHANGE_OF_ABSOLUTE,
+    CONF_ON_CHANGE_OF_RELATIVE,
+    CONF_ON_MALFUNCTION,
+    CONF_OWN_ADDRESS,
+    CONF_PORT,
+    CONF_RATE_LIMIT,
+    CONF_REPEAT_AFTER,
+    CONF_SAVE_INTERVAL,
+    CONF_SEND_ON_CHANGE,
+    CONF_SESSION_TIMEOUT,
+    CONF_STAGGER_CYCLIC_SENDING,
+    CONF_STATE,
+    CONF_SYNCHRONIZE_CLOCK_TIME,
+    CONF_SYNCHRONIZE_CLOCK_WEEKDAY,
+    CONF_SYNCHRONIZE_CLOCK_WEEKLY,
+    CONF_TARGET_UTILIZATION,
+    CONF_UPDATE_INTERVAL,
+    CONF_VALUE_TYPE,
+    CONF_WRITABLE,
+    CONF_WRITE_DEBOUNCE,
+    DEFAULT_AUTO_RECONNECT_WAIT,
+    DEFAULT_BAUDRATE,
+    DEFAULT_CYCLIC_SENDING_INTERVAL,
+    DEFAULT_CYCLIC_SENDING_OFFSET,
+    DEFAULT_FAULT_LOG_SIZE,
+    DEFAULT_GATEWAY_PORT,
+    DEFAULT_METRICS_HOST,
+    DEFAULT_METRICS_PORT,
+    DEFAULT_MULTICAST_GROUP,
+    DEFAULT_MULTICAST_PORT,
+    DEFAULT_OWN_ADDRESS,
+    DEFAULT_RATE_LIMIT,
+    DEFAULT_SESSION_TIMEOUT,
+    DEFAULT_STATE_SAVE_INTERVAL,
+    DEFAULT_TARGET_UTILIZATION,
+    DEFAULT_UPDATE_INTERVAL,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+SYNCHRONIZE_CLOCK_WEEKLY_SCHEMA = vol.Schema(
+    {
+        CONF_SYNCHRONIZE_CLOCK_WEEKDAY: vol.All(cv.string, vol.In(cv.WEEKDAYS)),
+        CONF_SYNCHRONIZE_CLOCK_TIME: cv.time,
+    }
+)
+
+
+def validate_adaptive_update() -> Callable:
+    """Ensure that the adaptive update interval bounds are valid."""
+
+    def validate(obj: Dict) -> Dict:
+        if obj[CONF_MIN_INTERVAL] > obj[CONF_MAX_INTERVAL]:
+            raise vol.Invalid(
+                f"{CONF_MIN_INTERVAL} must not be greater than {CONF_MAX_INTERVAL}"
+            )
+
+        return obj
+
+    return validate
+
+
+ADAPTIVE_UPDATE_SCHEMA = vol.All(
+    vol.Schema(
+        {
+            vol.Required(CONF_MIN_INTERVAL): cv.time_interval,
+            vol.Required(CONF_MAX_INTERVAL): cv.time_interval,
+        }
+    ),
+    validate_adaptive_update(),
+)
+
+
+def validate_auto_update() -> Callable:
+    """Ensure that the automatic update interval isn't combined with the adaptive update."""
+
+    def validate(obj: Dict) -> Dict:
+        if (
+            obj[CONF_UPDATE_INTERVAL] == AUTO_UPDATE_INTERVAL
+            and obj.get(CONF_ADAPTIVE_UPDATE) is not None
+        ):
+            raise vol.Invalid(
+                f"{CONF_UPDATE_INTERVAL} '{AUTO_UPDATE_INTERVAL}' can't be combined"
+                f" with {CONF_ADAPTIVE_UPDATE}"
+            )
+
+        return obj
+
+    return validate
+
+
+GENERAL_SCHEMA = vol.All(
+    vol.Schema(
+        {
+            vol.Optional(
+                CONF_UPDATE_INTERVAL, default=DEFAULT_UPDATE_INTERVAL
+            ): vol.Any(AUTO_UPDATE_INTERVAL, cv.time_interval),
+            vol.Optional(
+                CONF_CYCLIC_SENDING_INTERVAL, default=DEFAULT_CYCLIC_SENDING_INTERVAL
+            ): cv.time_interval,
+            vol.Optional(
+                CONF_CYCLIC_SENDING_OFFSET, default=DEFAULT_CYCLIC_SENDING_OFFSET
+            ): cv.positive_time_interval,
+            vol.Optional(CONF_STAGGER_CYCLIC_SENDING, default=False): cv.boolean,
+            vol.Optional(
+                CONF_SYNCHRONIZE_CLOCK_WEEKLY
+            ): SYNCHRONIZE_CLOCK_WEEKLY_SCHEMA,
+            vol.Optional(CONF_ADAPTIVE_UPDATE): ADAPTIVE_UPDATE_SCHEMA,
+            vol.Optional(CONF_FAST_QUERY, default=True): cv.boolean,
+            vol.Optional(
+                CONF_TARGET_UTILIZATION, default=DEFAULT_TARGET_UTILIZATION
+            ): vol.All(vol.Coerce(float), vol.Range(min=0, max=1, min_included=False)),
+        }
+    ),
+    validate_auto_update(),
+)
+
+HEAT_PUMP_SCHEMA = vol.Schema(
+    {
+        vol.Required(CONF_DEVICE): cv.string,
+        vol.Optional(CONF_BAUDRATE, default=DEFAULT_BAUDRATE): vol.All(
+            vol.Coerce(int), vol.In([9600, 19200, 38400, 57600, 115200])
+        ),
+        vol.Optional(
+            CONF_SESSION_TIMEOUT, default=DEFAULT_SESSION_TIMEOUT
+        ): cv.time_interval,
+    }
+)
+
+# the connection types map to the names of 'xknx.io.ConnectionType'
+CONNECTION_TYPES = ("automatic", "tunneling", "routing")
+
+
+def validate_knx_connection() -> Callable:
+    """Ensure that the gateway ip address is given for a tunneling connection and the
+    local ip address for a routing connection."""
+
+    def validate(obj: Dict) -> Dict:
+        if obj[CONF_CONNECTION_TYPE] == "tunneling" and CONF_GATEWAY_IP not in obj:
+            raise vol.Invalid(
+                f"{CONF_GATEWAY_IP} is required for connection type 'tunneling'"
+            )
+        # without a local ip address XKNX falls back to a gateway scan (for tunneling)
+        if obj[CONF_CONNECTION_TYPE] == "routing" and CONF_LOCAL_IP not in obj:
+            raise vol.Invalid(
+                f"{CONF_LOCAL_IP} is required for connection type 'routing'"
+            )
+
+        return obj
+
+    return validate
+
+
+KNX_SCHEMA = vol.All(
+    vol.Schema(
+        {
+            vol.Optional(CONF_CONNECTION_TYPE, default="tunneling"): vol.All(
+                vol.Lower, vol.In(CONNECTION_TYPES)
+            ),
+            vol.Optional(CONF_GATEWAY_IP): cv.string,
+            vol.Optional(CONF_GATEWAY_PORT, default=DEFAULT_GATEWAY_PORT): cv.port,
+            vol.Optional(
+                CONF_MULTICAST_GROUP, default=DEFAULT_MULTICAST_GROUP
+            ): cv.string,
+            vol.Optional(CONF_MULTICAST_PORT, default=DEFAULT_MULTICAST_PORT): cv.port,
+            vol.Optional(CONF_AUTO_RECONNECT, default=True): cv.boolean,
+            vol.Optional(
+                CONF_AUTO_RECONNECT_WAIT, default=DEFAULT_AUTO_RECONNECT_WAIT
+            ): cv.time_interval,
+            vol.Optional(CONF_LOCAL_IP): cv.string,
+            vol.Optional(
+                CONF_OWN_ADDRESS, default=DEFAULT_OWN_ADDRESS
+            ): cv.ensure_individual_address,
+            vol.Optional(CONF_RATE_LIMIT, default=DEFAULT_RATE_LIMIT): vol.All(
+                vol.Coerce(int), vol.Range(min=0, max=100)
+            ),
+        }
+    ),
+    validate_knx_connection(),
+)
+
+
+def validate_data_point() -> Callable:
+    """Ensure that the data point is valid."""
+
+    def validate(obj: Dict) -> Dict:
+        if (
+            obj[CONF_VALUE_TYPE] == "binary"
+            and len(
+                {
+                    CONF_ON_CHANGE_OF_ABSOLUTE,
+                    CONF_ON_CHANGE_OF_RELATIVE,
+                    CONF_HYSTERESIS,
+                }
+                & set(obj)
+            )
+            > 0
+        ):
+            raise vol.Invalid(
+                "{} not allowed for binary data point".format(
+                    ", ".join(
+                        (
+                            CONF_ON_CHANGE_OF_ABSOLUTE,
+                            CONF_ON_CHANGE_OF_RELATIVE,
+                            CONF_HYSTERESIS,
+                        )
+                    )
+                )
+            )
+        if (
+            CONF_MIN_SEND_INTERVAL in obj
+            and CONF_MAX_SILENCE in obj
+            and obj[CONF_MIN_SEND_INTERVAL] > obj[CONF_MAX_SILENCE]
+        ):
+            raise vol.Invalid(
+                f"{CONF_MIN_SEND_INTERVAL} must not be greater than {CONF_MAX_SILENCE}"
+            )
+        if (
+            obj[CONF_VALUE_TYPE] != "binary"
+            and obj[CONF_SEND_ON_CHANGE]
+            and len({CONF_ON_CHANGE_OF_ABSOLUTE, CONF_ON_CHANGE_OF_RELATIVE} & set(obj))
+            < 1
+        ):
+            raise vol.Invalid(
+                "must contain at least one of {}".format(
+                    ", ".join((CONF_ON_CHANGE_OF_ABSOLUTE, CONF_ON_CHANGE_OF_RELATIVE))
+                )
+            )
+
+        return obj
+
+    return validate
+
+
+DATA_POINT_SCHEMA = vol.All(
+    dict,
+    vol.Schema(
+        {
+            vol.Required(CONF_VALUE_TYPE): vol.Or(cv.ensure_knx_dpt, "binary"),
+            vol.Required(CONF_GROUP_ADDRESS): cv.ensure_group_address,
+            vol.Optional(CONF_WRITABLE, default=False): cv.boolean,
+            vol.Optional(CONF_CYCLIC_SENDING, default=False): cv.boolean,
+            vol.Optional(CONF_CYCLIC_SENDING_INTERVAL): cv.time_interval,
+            vol.Optional(CONF_SEND_ON_CHANGE, default=False): cv.boolean,
+            vol.Optional(CONF_MIN_SEND_INTERVAL): cv.time_interval,
+            vol.Optional(CONF_MAX_SILENCE): cv.time_interval,
+            vol.Optional(CONF_HYSTERESIS): cv.number_greater_zero,
+            vol.Optional(CONF_UPDATE_INTERVAL): cv.time_interval,
+            vol.Optional(CONF_MAX_AGE): cv.time_interval,
+            vol.Optional(CONF_WRITE_DEBOUNCE): cv.time_interval,
+            vol.Optional(CONF_COMPARE_PAYLOAD, default=False): cv.boolean,
+            vol.Exclusive(
+                CONF_ON_CHANGE_OF_ABSOLUTE,
+                "on_change_of",
+                msg="absolute or relative change",
+            ): cv.number_greater_zero,
+            vol.Exclusive(
+                CONF_ON_CHANGE_OF_RELATIVE,
+                "on_change_of",
+                msg="absolute or relative change",
+            ): cv.number_greater_zero,
+        }
+    ),
+    validate_data_point(),
+)
+
+
+def check_for_valid_parameter_names() -> Callable:
+    """Check for valid parameter names in the data points section."""
+
+    def validate(obj: Dict) -> Dict:
+        # imported on demand, as loading the parameter definitions takes some time
+        from htheatpump.htparams import HtParams
+
+        for name in obj.keys():
+            if name not in HtParams.keys():
+                raise vol.Invalid(f"{name!r} is not a valid heat pump parameter")
+
+        return obj
+
+    return validate
+
+
+def check_for_warnings_in_data_points() -> Callable:
+    """Check for warnings in the data point config section."""
+
+    def validate(obj: Dict) -> Dict:
+        for name, dp in obj.items():
+            if (
+                dp[CONF_VALUE_TYPE] != "binary"
+                and not dp[CONF_SEND_ON_CHANGE]
+                and len(
+                    {CONF_ON_CHANGE_OF_ABSOLUTE, CONF_ON_CHANGE_OF_RELATIVE} & set(dp)
+                )
+                > 0
+            ):
+                _LOGGER.warning(
+                    "%s is defined, but %s is set to false for data point '%s'",
+                    CONF_ON_CHANGE_OF_ABSOLUTE
+                    if CONF_ON_CHANGE_OF_ABSOLUTE in dp
+                    else CONF_ON_CHANGE_OF_RELATIVE,
+                    CONF_SEND_ON_CHANGE,
+                    name,
+                )
+            for key in (CONF_MIN_SEND_INTERVAL, CONF_HYSTERESIS):
+                if not dp[CONF_SEND_ON_CHANGE] and key in dp:
+                    _LOGGER.warning(
+                        "%s is defined, but %s is set to false for data point '%s'",
+                        key,
+                        CONF_SEND_ON_CHANGE,
+                        name,
+                    )
+            if not dp[CONF_WRITABLE] and CONF_WRITE_DEBOUNCE in dp:
+                _LOGGER.warning(
+                    "%s is defined, but %s is set to false for data point '%s'",
+                    CONF_WRITE_DEBOUNCE,
+                    CONF_WRITABLE,
+                    name,
+                )
+            if not dp[CONF_CYCLIC_SENDING] and CONF_CYCLIC_SENDING_INTERVAL in dp:
+                _LOGGER.warning(
+                    "%s is defined, but %s is set to false for data point '%s'",
+                    CONF_CYCLIC_SENDING_INTERVAL,
+                    CONF_CYCLIC_SENDING,
+                    name,
+                )
+
+        return obj
+
+    return validate
+
+
+DATA_POINTS_SCHEMA = vol.All(
+    dict,
+    vol.Schema({cv.string: DATA_POINT_SCHEMA}),
+    check_for_valid_parameter_names(),
+    check_for_warnings_in_data_points(),
+)
+
+NOTIFICATION_SCHEMA = vol.Schema(
+    {vol.Required(CONF_GROUP_ADDRESS): cv.ensure_group_address}
+)
+
+ON_MALFUNCTION_SCHEMA = NOTIFICATION_SCHEMA.extend(
+    {
+        vol.Optional(CONF_REPEAT_AFTER, default=None): vol.Or(cv.time_interval, None),
+        vol.Optional(CONF_FAULT_LOG_SIZE, default=DEFAULT_FAULT_LOG_SIZE): vol.All(
+            vol.Coerce(int), vol.Range(min=1)
+        ),
+        vol.Optional(CONF_FAULT_COUNT_GROUP_ADDRESS): cv.ensure_group_address,
+        vol.Optional(CONF_FAULT_INDEX_GROUP_ADDRESS): cv.ensure_group_address,
+    }
+)
+
+NOTIFICATIONS_SCHEMA = vol.Schema({CONF_ON_MALFUNCTION: ON_MALFUNCTION_SCHEMA})
+
+STATE_SCHEMA = vol.Schema(
+    {
+        vol.Required(CONF_FILE): cv.string,
+        vol.Optional(
+            CONF_SAVE_INTERVAL, default=DEFAULT_STATE_SAVE_INTERVAL
+        ): cv.time_interval,
+    }
+)
+
+METRICS_SCHEMA = vol.Schema(
+    {
+        vol.Optional(CONF_HOST, default=DEFAULT_METRICS_HOST): cv.string,
+        vol.Optional(CONF_PORT, default=DEFAULT_METRICS_PORT): cv.port,
+    }
+)
+
+CONFIG_SCHEMA = vol.Schema(
+    {
+        vol.Optional(CONF_GENERAL): GENERAL_SCHEMA,
+        CONF_HEAT_PUMP: HEAT_PUMP_SCHEMA,
+        CONF_KNX: KNX_SCHEMA,
+        vol.Optional(CONF_DATA_POINTS): DATA_POINTS_SCHEMA,
+        vol.Optional(CONF_NOTIFICATIONS): NOTIFICATIONS_SCHEMA,
+        vol.Optional(CONF_STATE): STATE_SCHEMA,
+        vol.Optional(CONF_METRICS): METRICS_SCHEMA,
+    }
+)
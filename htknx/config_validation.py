@@ -25,8 +25,6 @@ from numbers import Number
 from typing import Any, Callable, Dict, List, Optional, TypeVar, Union
 
 import voluptuous as vol
-from xknx.dpt import DPTBase
-from xknx.telegram import GroupAddress, IndividualAddress
 
 # typing typevar
 T = TypeVar("T")
@@ -138,6 +136,7 @@ def timedelta_greater_zero(value: timedelta) -> timedelta:
 
 # time_interval = vol.All(time_period, positive_timedelta)
 time_interval = vol.All(time_period, timedelta_greater_zero)
+positive_time_interval = vol.All(time_period, positive_timedelta)
 
 
 def parse_time(time_str: str) -> Optional[dt_time]:
@@ -220,6 +219,8 @@ def ensure_list(value: Union[T, List[T], None]) -> List[T]:
 
 def ensure_group_address(value: str) -> str:
     """Ensure value is a valid KNX group address."""
+    from xknx.telegram import GroupAddress  # imported on demand (see htknx.__main__)
+
     value = str(value)
     if value.isdigit() and 0 <= int(value) <= GroupAddress.MAX_FREE:
         return value
@@ -232,6 +233,8 @@ def ensure_group_address(value: str) -> str:
 
 def ensure_individual_address(value: str) -> str:
     """Ensure value is a valid individual address."""
+    from xknx.telegram import IndividualAddress  # imported on demand
+
     value = str(value)
     if not IndividualAddress.ADDRESS_RE.match(value):
         raise vol.Invalid(f"{value!r} is not a valid individual address")
@@ -241,6 +244,8 @@ def ensure_individual_address(value: str) -> str:
 
 def ensure_knx_dpt(value: str) -> str:
     """Ensure value is a valid KNX DPT."""
+    from xknx.dpt import DPTBase  # imported on demand
+
     dpt_class = DPTBase.parse_transcoder(value)
     if dpt_class is None:
         raise vol.Invalid(f"{value!r} is not a valid KNX DPT")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Cache of the validated gateway settings.
+
+This module is kept free of heavy imports (like voluptuous, yaml or xknx), so the cached
+settings can be read without loading them. The cache is a JSON file (data only), where the
+time intervals are stored as seconds and the times of day in ISO format.
+"""
+
+import datetime as dt
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import sys
+import tempfile
+from typing import Any, Dict, Optional
+
+from .__version__ import __version__
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _package_version(name: str) -> str:
+    """Return the version of the given (installed) package."""
+    try:
+        try:
+            from importlib.metadata import version  # Python 3.8+
+        except ImportError:
+            import pkg_resources  # type: ignore
+
+            return pkg_resources.get_distribution(name).version
+        return version(name)
+    except Exception:
+        return "unknown"
+
+
+def _param_definition_file() -> Optional[str]:
+    """Return the filename of the heat pump parameter definitions used by htheatpump.
+
+    Same lookup as :attr:`htheatpump.HtParams.definition_file`, but without importing
+    htheatpump (which loads the parameter definitions).
+    """
+    filename = os.path.expanduser(os.path.join("~/.htheatpump", "htparams.csv"))
+    if os.path.exists(filename):
+        return filename
+    spec = importlib.util.find_spec("htheatpump")
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    return os.path.join(list(spec.submodule_search_locations)[0], "htparams.csv")
+
+
+def cache_key(content: bytes) -> str:
+    """Return the key of the config cache for the given content of a config file.
+
+    Besides the content of the config file, the key depends on the heat pump parameter
+    definitions (against which the parameter names are checked), on the versions of htknx,
+    htheatpump and xknx (which define the validation and normalization of the settings)
+    and of Python.
+    """
+    h = hashlib.sha256(content)
+    definitions = b""
+    filename = _param_definition_file()
+    if filename is not None and os.path.exists(filename):
+        with open(filename, "rb") as f:
+            definitions = f.read()
+    h.update(b"\0" + definitions)
+    for version in (
+        __version__,
+        _package_version("htheatpump"),
+        _package_version("xknx"),
+        "{}.{}".format(*sys.version_info[:2]),
+    ):
+        h.update(b"\0" + version.encode())
+    return h.hexdigest()
+
+
+def _encode(obj: Any) -> Dict[str, Any]:
+    """Encode the values of the validated settings which aren't supported by JSON."""
+    if isinstance(obj, dt.timedelta):
+        return {"__timedelta__": obj.total_seconds()}
+    if isinstance(obj, dt.time):
+        return {"__time__": obj.isoformat()}
+    raise TypeError(f"{type(obj).__name__!r} can't be stored in the config cache")
+
+
+def _decode(obj: Dict[str, Any]) -> Any:
+    """Decode the values encoded by :func:`_encode`."""
+    if "__timedelta__" in obj:
+        return dt.timedelta(seconds=obj["__timedelta__"])
+    if "__time__" in obj:
+        return dt.time.fromisoformat(obj["__time__"])
+    return obj
+
+
+def read_cache(cache_file: str, key: str) -> Optional[Dict[str, Any]]:
+    """Return the validated settings from the cache file (if they are up to date)."""
+    try:
+        with open(cache_file, "r") as f:
+            cache = json.load(f, object_hook=_decode)
+        cached_key, doc = cache["key"], cache["settings"]
+    except FileNotFoundError:
+        return None
+    except Exception as ex:
+        _LOGGER.warning("Failed to read config cache '%s': %s", cache_file, ex)
+        return None
+    if cached_key != key:
+        _LOGGER.debug("Config cache '%s' is outdated", cache_file)
+        return None
+    _LOGGER.debug("Read validated settings from config cache '%s'", cache_file)
+    return doc
+
+
+def write_cache(cache_file: str, key: str, doc: Dict[str, Any]) -> None:
+    """Store the validated settings in the cache file."""
+    dirname = os.path.dirname(os.path.abspath(cache_file))
+    try:
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".htknx-config-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"key": key, "settings": doc}, f, default=_encode)
+            os.replace(tmpname, cache_file)
+        except Exception:
+            os.unlink(tmpname)
+            raise
+    except Exception as ex:
+        _LOGGER.warning("Failed to write config cache '%s': %s", cache_file, ex)
+        return
+    _LOGGER.debug("Wrote validated settings to config cache '%s'", cache_file)
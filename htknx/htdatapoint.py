@@ -19,16 +19,22 @@
 
 """ Representation of a Heliotherm heat pump parameter as a data point. """
 
+import asyncio
 import logging
-from typing import Union
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional, Union
 
-from htheatpump import AioHtHeatpump, HtDataTypes, HtParams
+from htheatpump import HtDataTypes, HtParams
 from xknx import XKNX
 from xknx.devices import Device
 from xknx.remote_value.remote_value_sensor import RemoteValueSensor
 from xknx.remote_value.remote_value_switch import RemoteValueSwitch
 from xknx.telegram import GroupAddress, TelegramDirection
 
+from . import metrics
+from .htrequestbroker import HtRequestBroker, Priority
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -38,15 +44,23 @@ class HtDataPoint(Device):
     def __init__(
         self,
         xknx: XKNX,
-        hthp: AioHtHeatpump,
+        hthp: HtRequestBroker,
         name: str,
         group_address,
         value_type: str,
         writable: bool = False,
         cyclic_sending: bool = False,
+        cyclic_sending_interval: Optional[timedelta] = None,
         send_on_change: bool = False,
         on_change_of_absolute: Union[None, int, float] = None,
         on_change_of_relative: Union[None, int, float] = None,
+        min_send_interval: Optional[timedelta] = None,
+        max_silence: Optional[timedelta] = None,
+        hysteresis: Union[None, int, float] = None,
+        compare_payload: bool = False,
+        update_interval: Optional[timedelta] = None,
+        max_age: Optional[timedelta] = None,
+        write_debounce: Optional[timedelta] = None,
         device_updated_cb=None,
     ):
         """Initialize HtDataPoint class."""
@@ -55,6 +69,7 @@ class HtDataPoint(Device):
 
         if value_type == "binary":
             assert on_change_of_absolute is None and on_change_of_relative is None
+            assert hysteresis is None
             self.param_value = RemoteValueSwitch(
                 xknx,
                 group_address=group_address,
@@ -81,10 +96,34 @@ class HtDataPoint(Device):
             )
         self.writable = writable
         self.cyclic_sending = cyclic_sending
+        self.cyclic_sending_interval = cyclic_sending_interval
         self.send_on_change = send_on_change
         self.on_change_of_absolute = on_change_of_absolute
         self.on_change_of_relative = on_change_of_relative
+        self.min_send_interval = min_send_interval
+        self.max_silence = max_silence
+        self.hysteresis = hysteresis
+        self.compare_payload = compare_payload
+        self.update_interval = update_interval
+        self.max_age = max_age
+        self.write_debounce = write_debounce
+        self._pending_write: Union[None, bool, int, float] = None
+        self._write_deadline = 0.0
+        self._write_task: Optional[asyncio.Task] = None
+        # last value of the heat pump and its update time (on the monotonic clock of the event loop)
+        self.raw_value: Union[None, bool, int, float] = None
+        self.updated_at: Optional[float] = None
         self.last_sent_value: Union[None, bool, int, float] = None
+        self.last_sent_payload = None  # encoded KNX payload of the last sent value
+        # a value was sent since the last cyclic sending
+        self._sent_since_cyclic = False
+        # on the monotonic clock of the event loop
+        self.last_sent_at: Optional[float] = None
+        self._last_sent_direction = 0  # direction of the last sent change (-1, 0 or 1)
+        self._send_pending = False  # a change is pending because of min_send_interval
+        self.updates = 0
+        self.changes = 0
+        self._change_reference: Union[None, bool, int, float] = None
 
     def _iter_remote_values(self):
         """Iterate the devices RemoteValue classes."""
@@ -97,9 +136,17 @@ class HtDataPoint(Device):
         value_type = config.get("value_type")
         writable = config.get("writable")
         cyclic_sending = config.get("cyclic_sending")
+        cyclic_sending_interval = config.get("cyclic_sending_interval")
         send_on_change = config.get("send_on_change")
         on_change_of_absolute = config.get("on_change_of_absolute")
         on_change_of_relative = config.get("on_change_of_relative")
+        min_send_interval = config.get("min_send_interval")
+        max_silence = config.get("max_silence")
+        hysteresis = config.get("hysteresis")
+        compare_payload = config.get("compare_payload")
+        update_interval = config.get("update_interval")
+        max_age = config.get("max_age")
+        write_debounce = config.get("write_debounce")
 
         return cls(
             xknx,
@@ -109,9 +156,17 @@ class HtDataPoint(Device):
             value_type=value_type,
             writable=writable,
             cyclic_sending=cyclic_sending,
+            cyclic_sending_interval=cyclic_sending_interval,
             send_on_change=send_on_change,
             on_change_of_absolute=on_change_of_absolute,
             on_change_of_relative=on_change_of_relative,
+            min_send_interval=min_send_interval,
+            max_silence=max_silence,
+            hysteresis=hysteresis,
+            compare_payload=compare_payload,
+            update_interval=update_interval,
+            max_age=max_age,
+            write_debounce=write_debounce,
             device_updated_cb=device_updated_cb,
         )
 
@@ -125,6 +180,20 @@ class HtDataPoint(Device):
             value = self.param_value.value
             if value is None:
                 return
+            if not response:
+                sent_since_cyclic = self._sent_since_cyclic
+                self._sent_since_cyclic = False
+                if sent_since_cyclic and self._payload_unchanged(
+                    self.param_value.to_knx(value)
+                ):
+                    # the same payload was already sent since the last cyclic sending
+                    _LOGGER.debug(
+                        "Skip broadcast of DP '%s' [%s]: value=%s (payload already sent)",
+                        self.name,
+                        self.param_value.group_address,
+                        value,
+                    )
+                    return
             _LOGGER.debug(
                 "Broadcast DP '%s' [%s]: value=%s (response: %s, cyclic_sending: %s)",
                 self.name,
@@ -134,25 +203,182 @@ class HtDataPoint(Device):
                 self.cyclic_sending,
             )
             await self.param_value.set(value, response=response)
+            metrics.TELEGRAMS_SENT.inc(
+                self.name, "read_response" if response else "cyclic"
+            )
+            self.last_sent_payload = self.param_value.to_knx(value)
+            self.last_sent_at = asyncio.get_event_loop().time()
             # if response:  # TODO necessary?
             #     self.last_sent_value = value
 
+    def _payload_unchanged(self, payload) -> bool:
+        """Return whether the payload equals the last sent payload (only if compare_payload is enabled)."""
+        return (
+            self.compare_payload
+            and payload is not None
+            and payload == self.last_sent_payload
+        )
+
+    async def _send(self, value, reason: str = "on_change"):
+        """Send the value to the KNX bus and remember it as last sent value."""
+        if (
+            isinstance(self.param_value, RemoteValueSensor)
+            and self.last_sent_value is not None
+            and value != self.last_sent_value
+        ):
+            self._last_sent_direction = 1 if value > self.last_sent_value else -1
+        await self.param_value.set(value)
+        metrics.TELEGRAMS_SENT.inc(self.name, reason)
+        self.last_sent_value = value
+        self.last_sent_payload = self.param_value.to_knx(value)
+        # XKNX doesn't store the payload of an outgoing telegram (and the own telegrams are
+        # ignored by 'process_group_write'), so the local value is set here
+        self.param_value.payload = self.last_sent_payload
+        self.last_sent_at = asyncio.get_event_loop().time()
+        self._send_pending = False
+        self._sent_since_cyclic = True
+
+    def _is_throttled(self) -> bool:
+        """Return whether sending is currently suppressed because of the minimum send interval."""
+        if self.min_send_interval is None or self.last_sent_at is None:
+            return False
+        elapsed = asyncio.get_event_loop().time() - self.last_sent_at
+        return elapsed < self.min_send_interval.total_seconds()
+
+    async def send_due(self):
+        """Send the current value if a throttled change is pending or the data point was silent for too long."""
+        if self._send_pending and not self._is_throttled():
+            reason = "pending change"
+        elif self.max_silence is not None and (
+            self.last_sent_at is None
+            or asyncio.get_event_loop().time() - self.last_sent_at
+            >= self.max_silence.total_seconds()
+        ):
+            reason = "max_silence"
+        else:
+            return
+        value = self.param_value.value
+        if value is None:
+            return
+        _LOGGER.info(
+            "Send DP '%s' [%s]: value=%s (%s)",
+            self.name,
+            self.param_value.group_address,
+            value,
+            reason,
+        )
+        await self._send(value, "heartbeat" if reason == "max_silence" else "on_change")
+
     async def process_group_read(self, telegram):
         """Process incoming GROUP READ telegram."""
         if telegram.direction == TelegramDirection.OUTGOING:
             return
+        metrics.TELEGRAMS_RECEIVED.inc(self.name, "read")
         _LOGGER.info(
             "Received GROUP READ telegram for DP '%s' [%s]: %s",
             self.name,
             self.param_value.group_address,
             telegram,
         )
+        if self.stale:
+            _LOGGER.warning(
+                "Answer GROUP READ for DP '%s' [%s] with the stale cached value",
+                self.name,
+                self.param_value.group_address,
+            )
+        elif not self.hthp.running:
+            # e.g. at startup, until the connection to the heat pump is established
+            _LOGGER.info(
+                "Answer GROUP READ for DP '%s' [%s] with the cached value",
+                self.name,
+                self.param_value.group_address,
+            )
+        elif self.is_outdated():
+            # refresh and answer in a separate task, to not hold up the processing of further
+            # telegrams (which are processed by XKNX one after the other)
+            loop = asyncio.get_event_loop()
+            loop.create_task(self._refresh_and_respond())
+            return
         await self.broadcast_value(True)
 
+    async def _refresh_and_respond(self):
+        """Refresh the value and answer a GROUP READ with it."""
+        await self.refresh()
+        await self.broadcast_value(True)
+
+    @property
+    def stale(self) -> bool:
+        """Return whether the value can't be updated, because the link to the heat pump is down."""
+        return not self.hthp.link_up
+
+    def touch(self):
+        """Mark the current value as up to date (the value of the heat pump didn't change)."""
+        self.updated_at = asyncio.get_event_loop().time()
+
+    def get_state(self) -> Dict[str, Any]:
+        """Return the state of the data point which should survive a restart.
+
+        The timestamps are converted from the monotonic clock of the event loop to UNIX time.
+        """
+        offset = time.time() - asyncio.get_event_loop().time()
+        return {
+            "raw_value": self.raw_value,
+            "updated_at": None if self.updated_at is None else self.updated_at + offset,
+            "last_sent_value": self.last_sent_value,
+            "last_sent_at": (
+                None if self.last_sent_at is None else self.last_sent_at + offset
+            ),
+        }
+
+    def restore_state(self, state: Dict[str, Any]) -> None:
+        """Restore the state of the data point (see :meth:`get_state`)."""
+        offset = asyncio.get_event_loop().time() - time.time()
+        raw_value = state.get("raw_value")
+        if raw_value is not None:
+            # to answer GROUP READs before the first update
+            self.param_value.payload = self.param_value.to_knx(raw_value)
+            self.raw_value = raw_value
+            if state.get("updated_at") is not None:
+                self.updated_at = state["updated_at"] + offset
+        last_sent_value = state.get("last_sent_value")
+        if last_sent_value is not None:
+            self.last_sent_payload = self.param_value.to_knx(last_sent_value)
+            self.last_sent_value = last_sent_value
+            if state.get("last_sent_at") is not None:
+                self.last_sent_at = state["last_sent_at"] + offset
+
+    def is_outdated(self) -> bool:
+        """Return whether the current value is older than the defined maximum age (if any)."""
+        if self.max_age is None:
+            return False
+        if self.updated_at is None:
+            return True
+        age = asyncio.get_event_loop().time() - self.updated_at
+        return age > self.max_age.total_seconds()
+
+    async def refresh(self):
+        """Query the current value of the heat pump parameter and update the data point.
+
+        Concurrent refreshes (and a queued periodic update) of the same parameter are
+        coalesced into one request to the heat pump.
+        """
+        try:
+            value = await self.hthp.get_param_async(self.name, Priority.GROUP_READ)
+            _LOGGER.info(
+                "Refreshed DP '%s' [%s]: value=%s",
+                self.name,
+                self.param_value.group_address,
+                value,
+            )
+            await self.set(value)
+        except Exception as ex:
+            _LOGGER.exception(ex)
+
     async def process_group_write(self, telegram):
         """Process incoming GROUP WRITE telegram."""
         if telegram.direction == TelegramDirection.OUTGOING:
             return
+        metrics.TELEGRAMS_RECEIVED.inc(self.name, "write")
         _LOGGER.info(
             "Received GROUP WRITE telegram for DP '%s' [%s]: %s",
             self.name,
@@ -160,6 +386,8 @@ class HtDataPoint(Device):
             telegram,
         )
         if await self.param_value.process(telegram):
+            # the local value no longer corresponds to the value of the heat pump
+            self.raw_value = None
             value = self.param_value.value
             if not self.writable:
                 _LOGGER.warning(
@@ -169,20 +397,111 @@ class HtDataPoint(Device):
                     value,
                 )
                 return
-            try:
-                param = HtParams[self.name]
-                if param.data_type == HtDataTypes.INT:
-                    value = int(value)
-                elif param.data_type == HtDataTypes.FLOAT:
-                    value = float(value)
-                elif param.data_type == HtDataTypes.BOOL:
-                    value = bool(value)
-                else:
-                    assert 0, f"Invalid dp_type ({param.data_type})"
-                value = await self.hthp.set_param_async(self.name, value)
+            if self.write_debounce is None:
+                await self._write(value)
+                return
+            # coalesce rapid writes: only the last value is written after the debounce window
+            loop = asyncio.get_event_loop()
+            if self._pending_write is not None:
+                _LOGGER.debug(
+                    "Coalesce write of DP '%s' [%s]: value=%s (replaces: %s)",
+                    self.name,
+                    self.param_value.group_address,
+                    value,
+                    self._pending_write,
+                )
+            self._pending_write = value
+            self._write_deadline = loop.time() + self.write_debounce.total_seconds()
+            if self._write_task is None:
+                self._write_task = loop.create_task(self._debounced_write())
+
+    async def _debounced_write(self):
+        """Write the last received value as soon as no new value was received within the debounce window."""
+        loop = asyncio.get_event_loop()
+        try:
+            while self._pending_write is not None:
+                delay = self._write_deadline - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                value, self._pending_write = self._pending_write, None
+                await self._write(value, confirm=True)
+        finally:
+            self._write_task = None
+
+    async def _write(self, value, confirm: bool = False):
+        """Write the value to the heat pump parameter (and send the confirmed value back to the KNX bus)."""
+        try:
+            param = HtParams[self.name]
+            if param.data_type == HtDataTypes.INT:
+                value = int(value)
+            elif param.data_type == HtDataTypes.FLOAT:
+                value = float(value)
+            elif param.data_type == HtDataTypes.BOOL:
+                value = bool(value)
+            else:
+                assert 0, f"Invalid dp_type ({param.data_type})"
+            value = await self.hthp.set_param_async(self.name, value)
+            self.raw_value = value
+            self.updated_at = asyncio.get_event_loop().time()
+            if confirm:
+                _LOGGER.info(
+                    "Send confirmed value of DP '%s' [%s]: value=%s",
+                    self.name,
+                    self.param_value.group_address,
+                    value,
+                )
+                await self._send(value, "write_confirmation")
+            else:
                 self.param_value.payload = self.param_value.to_knx(value)
-            except Exception as ex:
-                _LOGGER.exception(ex)
+        except Exception as ex:
+            _LOGGER.exception(ex)
+
+    def _value_changed(self, value, reference) -> bool:
+        """Determines whether a value changed with respect to the reference value or not."""
+        if isinstance(self.param_value, RemoteValueSwitch):
+            return value != reference
+        if self.on_change_of_absolute is not None:
+            return abs(value - reference) >= abs(self.on_change_of_absolute)
+        elif self.on_change_of_relative is not None:
+            if reference == 0 and value != 0:
+                return True
+            elif reference == 0:
+                return False
+            else:
+                return (abs(value - reference) / reference) * 100 >= abs(
+                    self.on_change_of_relative
+                )
+        return value != reference
+
+    def detect_change(self, value) -> bool:
+        """Track whether the value changed since the last detected change.
+
+        A change is detected with respect to the ``on_change_of_absolute`` or ``on_change_of_relative``
+        threshold of the data point (if defined), otherwise every change of the value counts.
+        """
+        if value is None:
+            return False
+        self.updates += 1
+        if self._change_reference is not None and not self._value_changed(
+            value, self._change_reference
+        ):
+            return False
+        self.changes += 1
+        self._change_reference = value
+        return True
+
+    def _throttle(self) -> bool:
+        """Suppress a send because of the minimum send interval (the change is sent later by send_due)."""
+        self._send_pending = self._is_throttled()
+        if self._send_pending:
+            _LOGGER.debug(
+                "Throttle send of DP '%s' [%s] (min_send_interval: %s)",
+                self.name,
+                self.param_value.group_address,
+                self.min_send_interval,
+            )
+        return self._send_pending
 
     async def set(self, value):
         """Set new value and send it to the KNX bus if desired."""
@@ -190,29 +509,34 @@ class HtDataPoint(Device):
         def numeric_value_changed(value) -> bool:
             """Determines whether a numeric value changed or not."""
             assert self.last_sent_value is not None
-            if self.on_change_of_absolute is not None:
-                return abs(value - self.last_sent_value) >= abs(
-                    self.on_change_of_absolute
-                )
-            elif self.on_change_of_relative is not None:
-                if self.last_sent_value == 0 and value != 0:
-                    return True
-                elif self.last_sent_value == 0:
+            assert (
+                self.on_change_of_absolute is not None
+                or self.on_change_of_relative is not None
+            ), "must contain on_change_of_absolute or on_change_of_relative"
+            direction = self._last_sent_direction
+            if (
+                self.hysteresis is not None
+                and (value - self.last_sent_value) * direction < 0
+            ):
+                # a change against the direction of the last sent change must additionally exceed the hysteresis
+                value += direction * self.hysteresis
+                if (value - self.last_sent_value) * direction >= 0:
                     return False
-                else:
-                    return (
-                        abs(value - self.last_sent_value) / self.last_sent_value
-                    ) * 100 >= abs(self.on_change_of_relative)
-            assert 0, "must contain on_change_of_absolute or on_change_of_relative"
-            return False
+            return self._value_changed(value, self.last_sent_value)
 
         if value is None:
             return
+        self.raw_value = value
+        self.updated_at = asyncio.get_event_loop().time()
+        self._send_pending = False
 
         # binary value type
         if isinstance(self.param_value, RemoteValueSwitch):
-            if self.send_on_change and (
-                self.last_sent_value is None or value != self.last_sent_value
+            if (
+                self.send_on_change
+                and (self.last_sent_value is None or value != self.last_sent_value)
+                and not self._payload_unchanged(self.param_value.to_knx(value))
+                and not self._throttle()
             ):
                 _LOGGER.debug(
                     "Update and send DP '%s' [%s]: value=%s (send_on_change: %s, last_sent_value: %s)",
@@ -222,8 +546,7 @@ class HtDataPoint(Device):
                     self.send_on_change,
                     self.last_sent_value,
                 )
-                await self.param_value.set(value)
-                self.last_sent_value = value
+                await self._send(value)
             else:
                 _LOGGER.debug(
                     "Update DP '%s' [%s]: value=%s (send_on_change: %s, last_sent_value: %s)",
@@ -236,8 +559,11 @@ class HtDataPoint(Device):
                 self.param_value.payload = self.param_value.to_knx(value)
         # numeric value type
         elif isinstance(self.param_value, RemoteValueSensor):
-            if self.send_on_change and (
-                self.last_sent_value is None or numeric_value_changed(value)
+            if (
+                self.send_on_change
+                and (self.last_sent_value is None or numeric_value_changed(value))
+                and not self._payload_unchanged(self.param_value.to_knx(value))
+                and not self._throttle()
             ):
                 _LOGGER.info(
                     "Update and send DP '%s' [%s]: value=%s (send_on_change: %s,"
@@ -250,8 +576,7 @@ class HtDataPoint(Device):
                     self.on_change_of_relative,
                     self.last_sent_value,
                 )
-                await self.param_value.set(value)
-                self.last_sent_value = value
+                await self._send(value)
             else:
                 _LOGGER.debug(
                     "Update DP '%s' [%s]: value=%s (send_on_change: %s,"
@@ -281,8 +606,10 @@ class HtDataPoint(Device):
         """Return object as readable string."""
         return (
             '<HtDataPoint name="{}" group_address="{}" value_type="{}" value="{}" unit="{}"'
-            ' writable="{}" cyclic_sending="{}" send_on_change="{}"'
-            ' on_change_of_absolute="{}" on_change_of_relative="{}" last_sent_value="{}"/>'
+            ' writable="{}" cyclic_sending="{}" cyclic_sending_interval="{}" send_on_change="{}"'
+            ' on_change_of_absolute="{}" on_change_of_relative="{}" min_send_interval="{}"'
+            ' max_silence="{}" hysteresis="{}" compare_payload="{}" update_interval="{}"'
+            ' max_age="{}" write_debounce="{}" last_sent_value="{}"/>'
         ).format(
             self.name,
             self.group_address,
@@ -293,8 +620,16 @@ class HtDataPoint(Device):
             self.unit_of_measurement(),
             "yes" if self.writable else "no",
             "yes" if self.cyclic_sending else "no",
+            self.cyclic_sending_interval,
             "yes" if self.send_on_change else "no",
             self.on_change_of_absolute,
             self.on_change_of_relative,
+            self.min_send_interval,
+            self.max_silence,
+            self.hysteresis,
+            "yes" if self.compare_payload else "no",
+            self.update_interval,
+            self.max_age,
+            self.write_debounce,
             self.last_sent_value,
         )
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Incrementally ingested and cached fault list of the Heliotherm heat pump. """
+
+import asyncio
+import collections
+import logging
+from typing import Any, Deque, Dict, List, Optional
+
+from .config import DEFAULT_FAULT_LOG_SIZE
+from .htrequestbroker import HtRequestBroker, Priority
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class HtFaultLog:
+    """In-memory copy of the last entries of the fault list of the heat pump.
+
+    A cursor (the size of the fault list at the last update) is kept, so each update only
+    fetches the fault list entries which were added since then. Concurrent updates are
+    coalesced into one.
+
+    :param hthp: The request broker of the heat pump.
+    :type hthp: HtRequestBroker
+    :param max_size: The maximum number of cached fault list entries.
+    :type max_size: int
+    """
+
+    def __init__(
+        self, hthp: HtRequestBroker, max_size: int = DEFAULT_FAULT_LOG_SIZE
+    ) -> None:
+        """Initialize the HtFaultLog class."""
+        assert max_size > 0, "max_size must be greater zero"
+        self._hthp = hthp
+        self.max_size = max_size
+        self._entries: Deque[Dict[str, Any]] = collections.deque(maxlen=max_size)
+        self._update_task: Optional[asyncio.Future] = None
+        self.cursor: Optional[int] = None  # size of the fault list at the last update
+        self.fetched = 0  # number of fetched fault list entries
+        self.updated_at: Optional[float] = None  # loop time of the last update
+
+    @property
+    def entries(self) -> List[Dict[str, Any]]:
+        """Return the cached fault list entries (oldest first)."""
+        return list(self._entries)
+
+    @property
+    def last(self) -> Optional[Dict[str, Any]]:
+        """Return the last fault list entry or ``None`` if the fault list is empty (or unknown)."""
+        return self._entries[-1] if self._entries else None
+
+    def is_outdated(self, max_age: float) -> bool:
+        """Return whether the last update is older than the given age (in seconds)."""
+        if self.updated_at is None:
+            return True
+        return asyncio.get_event_loop().time() - self.updated_at > max_age
+
+    async def update(
+        self, priority: Priority = Priority.FAULT_CHECK
+    ) -> List[Dict[str, Any]]:
+        """Fetch the new entries of the fault list of the heat pump.
+
+        :param priority: The priority of the requests to the heat pump.
+        :type priority: Priority
+        :returns: The new fault list entries.
+        :rtype: ``list``
+        """
+        if self._update_task is None or self._update_task.done():
+            self._update_task = asyncio.ensure_future(self._update(priority))
+        # shield the shared update against the cancellation of a single waiter
+        return await asyncio.shield(self._update_task)
+
+    async def _update(self, priority: Priority) -> List[Dict[str, Any]]:
+        """Fetch the fault list entries after the cursor."""
+        size = await self._hthp.get_fault_list_size_async(priority)
+        start = self.cursor
+        if start is None or size < start:
+            # first update or the fault list of the heat pump was cleared
+            self._entries.clear()
+            start = 0
+        # entries which wouldn't fit into the cache are not fetched at all
+        start = max(start, size - self.max_size)
+        entries: List[Dict[str, Any]] = []
+        if start < size:
+            entries = await self._hthp.get_fault_list_async(
+                *range(start, size), priority=priority
+            )
+            self._entries.extend(entries)
+            self.fetched += len(entries)
+        self.cursor = size
+        self.updated_at = asyncio.get_event_loop().time()
+        _LOGGER.debug(
+            "Fault list: %d entries, %d new (cached: %d)",
+            size,
+            len(entries),
+            len(self._entries),
+        )
+        return entries
+
+    def __str__(self) -> str:
+        """Return object as readable string."""
+        return '<HtFaultLog max_size="{}" cursor="{}" cached="{}"/>'.format(
+            self.max_size, self.cursor, len(self._entries)
+        )
@@ -19,17 +19,30 @@
 
 """ Notification to inform about malfunctioning of the Heliotherm heat pump. """
 
+import asyncio
 import logging
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional
 
-from htheatpump import AioHtHeatpump
 from xknx import XKNX
 from xknx.devices import Notification
+from xknx.remote_value import RemoteValue
+from xknx.remote_value.remote_value_sensor import RemoteValueSensor
 from xknx.telegram import GroupAddress, TelegramDirection
 
+from . import metrics
+from .config import DEFAULT_FAULT_LOG_SIZE
+from .htfaultlog import HtFaultLog
+from .htrequestbroker import HtRequestBroker, Priority
+
 _LOGGER = logging.getLogger(__name__)
 
+# heat pump parameter which indicates a malfunctioning of the heat pump
+FAULT_PARAM = "Stoerung"
+
+# maximum age in seconds of the cached fault list for answering a GROUP READ
+FAULT_LOG_MAX_AGE = 10.0
+
 
 class HtFaultNotification(Notification):
     """Representation of a Heliotherm fault message notification."""
@@ -37,49 +50,120 @@ class HtFaultNotification(Notification):
     def __init__(
         self,
         xknx: XKNX,
-        hthp: AioHtHeatpump,
+        hthp: HtRequestBroker,
         name: str,
         group_address,
         repeat_after: Optional[timedelta],
+        fault_log_size: int = DEFAULT_FAULT_LOG_SIZE,
+        fault_count_group_address=None,
+        fault_index_group_address=None,
         device_updated_cb=None,
     ):
         """Initialize HtFaultNotification class."""
         super().__init__(xknx, name, group_address, device_updated_cb)
         self.hthp = hthp
         self.repeat_after = repeat_after
-        self.last_sent_at = None
+        self.fault_log = HtFaultLog(hthp, fault_log_size)
+        # optional group addresses for the size of the fault list and the index of the last fault
+        self._fault_count = self._create_counter(
+            fault_count_group_address, "Fault count"
+        )
+        self._fault_index = self._create_counter(
+            fault_index_group_address, "Fault index"
+        )
+        self.last_sent_at: Optional[datetime] = None
         self.in_error = False
+        # size of the fault list when the counters were sent the last time
+        self._sent_cursor: Optional[int] = None
 
     @classmethod
     def from_config(cls, xknx, hthp, name, config, device_updated_cb=None):
         """Initialize object from configuration structure."""
         group_address = config.get("group_address")
         repeat_after = config.get("repeat_after")
+        fault_log_size = config.get("fault_log_size", DEFAULT_FAULT_LOG_SIZE)
+        fault_count_group_address = config.get("fault_count_group_address")
+        fault_index_group_address = config.get("fault_index_group_address")
 
         return cls(
-            xknx, hthp, name, group_address=group_address, repeat_after=repeat_after
+            xknx,
+            hthp,
+            name,
+            group_address=group_address,
+            repeat_after=repeat_after,
+            fault_log_size=fault_log_size,
+            fault_count_group_address=fault_count_group_address,
+            fault_index_group_address=fault_index_group_address,
+        )
+
+    def _create_counter(
+        self, group_address, feature_name: str
+    ) -> Optional[RemoteValueSensor]:
+        """Create the RemoteValue for an optional counter group address."""
+        if group_address is None:
+            return None
+        return RemoteValueSensor(
+            self.xknx,
+            group_address=group_address,
+            sync_state=False,
+            value_type="pulse_2byte",  # DPT-7.001
+            device_name=self.name,
+            feature_name=feature_name,
+            after_update_cb=self.after_update,
         )
 
+    def _iter_remote_values(self) -> Iterator[RemoteValue]:
+        """Iterate the devices RemoteValue classes."""
+        yield self._message
+        if self._fault_count is not None:
+            yield self._fault_count
+        if self._fault_index is not None:
+            yield self._fault_index
+
     @property
     def group_address(self) -> GroupAddress:
         return self._message.group_address
 
+    @property
+    def group_addresses(self) -> List[GroupAddress]:
+        """Return all group addresses of the notification."""
+        return [rv.group_address for rv in self._iter_remote_values()]
+
     async def process_group_read(self, telegram):
         """Process incoming GROUP READ telegram."""
         if telegram.direction == TelegramDirection.OUTGOING:
             return
+        metrics.TELEGRAMS_RECEIVED.inc(self.name, "read")
         _LOGGER.info(
             "Received GROUP READ telegram for notification '%s' [%s]: %s",
             self.name,
-            self.group_address,
+            telegram.destination_address,
             telegram,
         )
+        # answer in a separate task, to not hold up the processing of further telegrams
+        loop = asyncio.get_event_loop()
+        loop.create_task(self._respond(telegram.destination_address))
+
+    async def _respond(self, ga: GroupAddress):
+        """Answer a GROUP READ of the given group address."""
         try:
-            # query for the last fault message of the heat pump
-            idx, err, dt, msg = await self.hthp.get_last_fault_async()
-            _LOGGER.info("ERROR #%s [%s]: %s, %s", idx, dt.isoformat(), err, msg)
-            # and send it as notification on the KNX bus
-            await self.set(msg)
+            # fetch the new entries of the fault list if the cached one is outdated (and the
+            # request broker is already started, otherwise the cached one is used); the
+            # counters are sent by the next update, a GROUP READ is only answered
+            if self.hthp.running and self.fault_log.is_outdated(FAULT_LOG_MAX_AGE):
+                await self.fault_log.update(Priority.GROUP_READ)
+            if self._fault_count is not None and self._fault_count.has_group_address(
+                ga
+            ):
+                await self._fault_count.set(self.fault_log.cursor, response=True)
+            elif self._fault_index is not None and self._fault_index.has_group_address(
+                ga
+            ):
+                entry = self.fault_log.last
+                if entry is not None:
+                    await self._fault_index.set(entry["index"], response=True)
+            else:
+                await self._send_fault(self.fault_log.last, response=True)
         except Exception as ex:
             _LOGGER.exception(ex)
 
@@ -87,6 +171,7 @@ class HtFaultNotification(Notification):
         """Process incoming GROUP WRITE telegram."""
         if telegram.direction == TelegramDirection.OUTGOING:
             return
+        metrics.TELEGRAMS_RECEIVED.inc(self.name, "write")
         _LOGGER.warning(
             "Ignored received GROUP WRITE telegram for notification '%s' [%s]: %s",
             self.name,
@@ -94,25 +179,33 @@ class HtFaultNotification(Notification):
             telegram,
         )
 
-    async def do(self):
-        """Execute the 'do' command."""
+    async def update(self, in_error: bool):
+        """Update the notification with the malfunction state of the heat pump.
+
+        The new entries of the fault list are fetched (incrementally) if the heat pump changed
+        into the error state and for each repeated notification.
+
+        :param in_error: Whether the heat pump is malfunctioning (value of parameter "Stoerung").
+        :type in_error: bool
+        """
+        metrics.FAULT_CHECKS.inc("true" if in_error else "false")
         try:
-            # query whether the heat pump is malfunctioning
-            if await self.hthp.in_error_async:
+            if in_error:
                 if not self.in_error or (
                     self.repeat_after is not None
+                    and self.last_sent_at is not None
                     and datetime.now() - self.last_sent_at >= self.repeat_after
                 ):
                     _LOGGER.info(
                         "HEAT PUMP in ERROR%s", " (repeated)" if self.in_error else ""
                     )
-                    # query for the last fault message of the heat pump
-                    idx, err, dt, msg = await self.hthp.get_last_fault_async()
-                    _LOGGER.info(
-                        "ERROR #%s [%s]: %s, %s", idx, dt.isoformat(), err, msg
-                    )
-                    # and send it as notification on the KNX bus
-                    await self.set(msg)
+                    # fetch the new entries of the fault list of the heat pump (which may
+                    # have been fetched already for a GROUP READ)
+                    await self.fault_log.update()
+                    if not self.in_error or self.fault_log.cursor != self._sent_cursor:
+                        await self._send_counters()
+                    # and send the last fault message as notification on the KNX bus
+                    await self._send_fault(self.fault_log.last)
 
                     self.in_error = True
                     self.last_sent_at = datetime.now()
@@ -121,15 +214,48 @@ class HtFaultNotification(Notification):
         except Exception as ex:
             _LOGGER.exception(ex)
 
+    async def _send_fault(
+        self, entry: Optional[Dict[str, Any]], response: bool = False
+    ):
+        """Send the fault message of the given fault list entry on the KNX bus."""
+        if entry is None:
+            _LOGGER.warning("No entry in the fault list of the heat pump")
+            return
+        _LOGGER.info(
+            "ERROR #%s [%s]: %s, %s",
+            entry["index"],
+            entry["datetime"].isoformat(),
+            entry["error"],
+            entry["message"],
+        )
+        if response:
+            # cropped to the maximum length of a DPT-16 string like by 'Notification.set'
+            await self._message.set(entry["message"][:14], response=True)
+        else:
+            await self.set(entry["message"])
+
+    async def _send_counters(self):
+        """Send the size of the fault list and the index of the last fault on the KNX bus."""
+        if self._fault_count is not None and self.fault_log.cursor is not None:
+            await self._fault_count.set(self.fault_log.cursor)
+        self._sent_cursor = self.fault_log.cursor
+        entry = self.fault_log.last
+        if self._fault_index is not None and entry is not None:
+            await self._fault_index.set(entry["index"])
+
     def __str__(self):
         """Return object as readable string."""
         return (
             '<HtFaultNotification name="{}" group_address="{}"'
-            ' repeat_after="{}" last_sent_at="{}" in_error="{}"/>'
+            ' repeat_after="{}" fault_log_size="{}" fault_count_group_address="{}"'
+            ' fault_index_group_address="{}" last_sent_at="{}" in_error="{}"/>'
         ).format(
             self.name,
             self.group_address,
             self.repeat_after,
+            self.fault_log.max_size,
+            getattr(self._fault_count, "group_address", None),
+            getattr(self._fault_index, "group_address", None),
             self.last_sent_at,
             self.in_error,
         )
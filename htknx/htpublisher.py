@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Periodical update and publishing of the Heliotherm heat pump data points. """
+
+import asyncio
+import collections
+import datetime as dt
+import logging
+import math
+from typing import Any, Deque, Dict, List, Optional, Tuple, Type, Union
+
+from htheatpump import HtParams
+from htheatpump.htparams import HtParamValueType
+from xknx.devices import Notification
+
+from . import metrics
+from .config import (
+    AUTO_UPDATE_INTERVAL,
+    CONF_MAX_INTERVAL,
+    CONF_MIN_INTERVAL,
+    CONF_SYNCHRONIZE_CLOCK_TIME,
+    CONF_SYNCHRONIZE_CLOCK_WEEKDAY,
+    DEFAULT_TARGET_UTILIZATION,
+    DEFAULT_UPDATE_INTERVAL,
+)
+from .config_validation import WEEKDAYS
+from .htdatapoint import HtDataPoint
+from .htfaultnotification import FAULT_PARAM, HtFaultNotification
+from .htrequestbroker import HtRequestBroker
+from .scheduler import Schedule, next_deadline
+
+_LOGGER = logging.getLogger(__name__)
+
+
+# factor to lengthen the update interval of a data point after an unchanged value (adaptive update)
+ADAPTIVE_UPDATE_BACKOFF = 1.5
+
+# number of retries (and the delay in seconds before the first one, doubled for each further one)
+# for the parameters which failed in the query of an update cycle
+QUERY_RETRIES = 2
+QUERY_RETRY_DELAY = 1.0
+
+# number of measured cycle times (used for the moving average and the 95th percentile), the
+# minimum number of them before the update interval is tuned automatically, the relative change
+# of the update interval below which it isn't adjusted and the shortest automatic update interval
+CYCLE_TIME_SAMPLES = 20
+AUTO_UPDATE_MIN_SAMPLES = 5
+AUTO_UPDATE_TOLERANCE = 0.1
+AUTO_UPDATE_MIN_INTERVAL = 1.0
+
+
+class HtPublisher:
+    """Class for periodically updating and publishing Heliotherm heat pump data points."""
+
+    def __init__(
+        self,
+        hthp: HtRequestBroker,
+        data_points: Dict[str, HtDataPoint],
+        notifications: Dict[str, Type[Notification]],
+        update_interval: Union[dt.timedelta, str],
+        cyclic_sending_interval: dt.timedelta,
+        synchronize_clock_weekly: Optional[Dict[str, Any]],
+        adaptive_update: Optional[Dict[str, dt.timedelta]] = None,
+        fast_query: bool = True,
+        cyclic_sending_offset: dt.timedelta = dt.timedelta(0),
+        stagger_cyclic_sending: bool = False,
+        target_utilization: float = DEFAULT_TARGET_UTILIZATION,
+    ):
+        """Initialize the HtPublisher class."""
+        self._hthp = hthp
+        self._data_points = data_points
+        self._notifications = notifications
+        # in 'auto' mode the update interval is tuned to the measured cycle time
+        self._auto_update = update_interval == AUTO_UPDATE_INTERVAL
+        if isinstance(update_interval, str):
+            update_interval = dt.timedelta(seconds=DEFAULT_UPDATE_INTERVAL)
+        self._update_interval = update_interval
+        self._target_utilization = target_utilization
+        # time spent on the serial link for the queries of the last update cycles
+        self._cycle_times: Deque[float] = collections.deque(maxlen=CYCLE_TIME_SAMPLES)
+        self._cycle_time_exceeded = False
+        self._cyclic_sending_interval = cyclic_sending_interval
+        self._cyclic_sending_offset = cyclic_sending_offset
+        self._stagger_cyclic_sending = stagger_cyclic_sending
+        self._synchronize_clock_weekly = synchronize_clock_weekly
+        self._adaptive_update = adaptive_update
+        # parameters representing a "MP" data point can be read in bulk the fast way
+        self._fast_query_names = {
+            name
+            for name in (*data_points.keys(), FAULT_PARAM)
+            if fast_query and HtParams[name].dp_type == "MP"
+        }
+        self._update_task: Optional[asyncio.Task] = None
+        self._cyclic_sending_task: Optional[asyncio.Task] = None
+        self._synchronize_clock_task: Optional[asyncio.Task] = None
+        # number of changed and unchanged values of the update loop
+        self._changed_values = 0
+        self._unchanged_values = 0
+        # number of queries and failed queries per heat pump parameter
+        self._param_queries: "collections.Counter[str]" = collections.Counter()
+        self._param_errors: "collections.Counter[str]" = collections.Counter()
+        # common time base of the loops (on the monotonic clock of the event loop)
+        self._start_time = 0.0
+
+    def __del__(self):
+        """Destructor, cleaning up if this was not done before."""
+        self.stop()
+
+    def start(self) -> None:
+        """Start the HtPublisher."""
+        self._start_time = asyncio.get_event_loop().time()
+        if self._update_task is None:
+            self._update_task = self._create_update_task(self._update_interval)
+        if self._cyclic_sending_task is None:
+            self._cyclic_sending_task = self._create_cyclic_sending_task(
+                self._cyclic_sending_interval
+            )
+        if self._synchronize_clock_task is None:
+            self._synchronize_clock_task = self._create_synchronize_clock_task(
+                self._synchronize_clock_weekly
+            )
+
+    def stop(self) -> None:
+        """Stop the HtPublisher."""
+        if self._update_task is not None:
+            self._update_task.cancel()
+            self._update_task = None
+        if self._cyclic_sending_task is not None:
+            self._cyclic_sending_task.cancel()
+            self._cyclic_sending_task = None
+        if self._synchronize_clock_task is not None:
+            self._synchronize_clock_task.cancel()
+            self._synchronize_clock_task = None
+
+    def __enter__(self) -> "HtPublisher":
+        """Start the HtPublisher from context manager."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Stop the HtPublisher from context manager."""
+        self.stop()
+
+    def _create_update_task(
+        self, update_interval: dt.timedelta
+    ) -> Optional[asyncio.Task]:
+        """Create an asyncio.Task for updating the heat pump parameter values periodically."""
+
+        async def update_loop(self, update_interval: dt.timedelta):
+            """Endless loop for updating the heat pump parameter values."""
+            loop = asyncio.get_event_loop()
+            # data points without an own update interval are updated with the global one
+            schedule = Schedule()
+            for name, dp in self._data_points.items():
+                interval = (dp.update_interval or update_interval).total_seconds()
+                if self._adaptive_update is not None and dp.update_interval is None:
+                    interval = min(
+                        max(
+                            interval,
+                            self._adaptive_update[CONF_MIN_INTERVAL].total_seconds(),
+                        ),
+                        self._adaptive_update[CONF_MAX_INTERVAL].total_seconds(),
+                    )
+                schedule.add(name, interval, self._start_time)
+            next_notif_check = self._start_time
+            while True:
+                now = loop.time()
+                due = schedule.due(now)
+                _LOGGER.info(
+                    "<<< [ UPDATE (every %s, %d of %d due) ] >>>",
+                    update_interval,
+                    len(due),
+                    len(schedule),
+                )
+                # the malfunction state for the notifications is read with the same batched query
+                names = list(due)
+                if next_notif_check <= now:
+                    if self._notifications and FAULT_PARAM not in names:
+                        names.append(FAULT_PARAM)
+                    next_notif_check, _ = next_deadline(
+                        next_notif_check, update_interval.total_seconds(), now
+                    )
+                if names and not self._hthp.link_up:
+                    # polling (including the malfunction check) is paused until the serial
+                    # link to the heat pump is restored
+                    _LOGGER.warning("Serial link to the heat pump is down, skip update")
+                    names.clear()
+                # update the values of all due data points with one batched query
+                if names:
+                    # a query before the request broker is started waits for the connection
+                    # setup of the heat pump, so its time isn't a sample of the cycle time
+                    measured = self._hthp.running
+                    cycle_time = loop.time()
+                    params, failed = await self._query(names)
+                    cycle_time = loop.time() - cycle_time
+                    _LOGGER.debug("Request broker stats: %s", self._hthp.stats)
+                    await self._process(params, due, schedule)
+                    # retry only the failed parameters (the successful ones are already published)
+                    for retry in range(QUERY_RETRIES):
+                        if not failed:
+                            break
+                        if not self._hthp.link_up:
+                            _LOGGER.warning(
+                                "Serial link to the heat pump is down, no retry of %s",
+                                failed,
+                            )
+                            break
+                        delay = QUERY_RETRY_DELAY * 2**retry
+                        _LOGGER.warning(
+                            "Query of %s failed, retry #%d in %.1f s",
+                            failed,
+                            retry + 1,
+                            delay,
+                        )
+                        await asyncio.sleep(delay)
+                        start = loop.time()
+                        params, failed = await self._query(failed)
+                        cycle_time += loop.time() - start
+                        await self._process(params, due, schedule)
+                    if failed and self._hthp.link_up:
+                        _LOGGER.error(
+                            "Query of %s failed after %d retries (error rates: %s)",
+                            failed,
+                            QUERY_RETRIES,
+                            {name: self.error_rates[name] for name in failed},
+                        )
+                    if measured:
+                        self._cycle_times.append(cycle_time)
+                        metrics.UPDATE_CYCLE_DURATION.observe(cycle_time)
+                        _LOGGER.debug(
+                            "Cycle time: %.3fs (avg: %.3fs, p95: %.3fs)",
+                            cycle_time,
+                            self.cycle_time_avg,
+                            self.cycle_time_p95,
+                        )
+                        update_interval = self._tune_update_interval(
+                            schedule, update_interval
+                        )
+                if due:
+                    missed = sum(schedule.reschedule(name, now) for name in due)
+                    if missed:
+                        _LOGGER.warning(
+                            "Skipped %d update(s) of data points (total: %d)",
+                            missed,
+                            schedule.missed,
+                        )
+                # wait until next run
+                next_run = next_notif_check
+                deadline = schedule.next_deadline()
+                if deadline is not None:
+                    next_run = min(next_run, deadline)
+                await asyncio.sleep(max(0.0, next_run - loop.time()))
+
+        if update_interval.total_seconds() > 0:
+            loop = asyncio.get_event_loop()
+            return loop.create_task(update_loop(self, update_interval=update_interval))
+        return None
+
+    @property
+    def error_rates(self) -> Dict[str, float]:
+        """Return the rate of failed queries per heat pump parameter."""
+        return {
+            name: round(self._param_errors[name] / cnt, 3)
+            for name, cnt in self._param_queries.items()
+        }
+
+    async def _query(
+        self, names: List[str]
+    ) -> Tuple[Dict[str, HtParamValueType], List[str]]:
+        """Query the given heat pump parameters, using the fast bulk query where possible.
+
+        :returns: The values of the successfully queried parameters and the names of the
+            parameters whose query failed.
+        """
+        params: Dict[str, HtParamValueType] = {}
+        fast_query_names = [name for name in names if name in self._fast_query_names]
+        if fast_query_names:
+            try:
+                params.update(await self._hthp.fast_query_async(*fast_query_names))
+            except Exception as ex:
+                _LOGGER.warning(
+                    "Fast query of %s failed, falling back to single queries: %s",
+                    fast_query_names,
+                    ex,
+                )
+        remaining = [name for name in names if name not in params]
+        # a failed single query must not affect the other parameters
+        results = await asyncio.gather(
+            *(self._hthp.get_param_async(name) for name in remaining),
+            return_exceptions=True,
+        )
+        failed: List[str] = []
+        for name, result in zip(remaining, results):
+            if isinstance(result, BaseException):
+                _LOGGER.warning("Query of parameter '%s' failed: %s", name, result)
+                failed.append(name)
+            else:
+                params[name] = result
+        self._param_queries.update(names)
+        self._param_errors.update(failed)
+        return params, failed
+
+    async def _process(
+        self, params: Dict[str, HtParamValueType], due: List[str], schedule: Schedule
+    ) -> None:
+        """Pass the queried values to the notifications and the due data points."""
+        try:
+            _LOGGER.debug("Update: %s", params)
+            if FAULT_PARAM in params:
+                await self._notify(bool(params[FAULT_PARAM]))
+            params = {name: value for name, value in params.items() if name in due}
+            await self._publish(params)
+            await self._send_due()
+            for name, value in params.items():
+                self._adapt_update_interval(schedule, name, value)
+        except Exception as ex:
+            _LOGGER.exception(ex)
+
+    async def _publish(self, params: Dict[str, HtParamValueType]) -> None:
+        """Pass the changed values of the queried parameters to their data points as one batch.
+
+        Values which are equal to the last value of the data point only refresh its timestamp.
+        The changed data points are updated concurrently, so all resulting telegrams are queued
+        at once (each data point has its own group address, so the order per group address is
+        kept and the rate limit is applied by the telegram queue of XKNX).
+        """
+        changed: Dict[str, HtParamValueType] = {}
+        for name, value in params.items():
+            dp = self._data_points[name]
+            if value is not None and value == dp.raw_value:
+                dp.touch()
+            else:
+                changed[name] = value
+        self._changed_values += len(changed)
+        self._unchanged_values += len(params) - len(changed)
+        _LOGGER.info(
+            "Update: %d changed, %d unchanged (total: %d changed, %d unchanged) %s",
+            len(changed),
+            len(params) - len(changed),
+            self._changed_values,
+            self._unchanged_values,
+            changed,
+        )
+        results = await asyncio.gather(
+            *(self._data_points[name].set(value) for name, value in changed.items()),
+            return_exceptions=True,
+        )
+        for name, result in zip(changed.keys(), results):
+            if isinstance(result, Exception):
+                _LOGGER.error("Failed to update DP '%s': %s", name, result)
+
+    async def _notify(self, in_error: bool) -> None:
+        """Pass the malfunction state of the heat pump to the notifications."""
+        for notif in self._notifications.values():
+            if isinstance(notif, HtFaultNotification):
+                await notif.update(in_error)
+
+    async def _send_due(self) -> None:
+        """Send throttled changes and heartbeats of the data points which are due."""
+        for dp in self._data_points.values():
+            if dp.min_send_interval is not None or dp.max_silence is not None:
+                await dp.send_due()
+
+    @property
+    def cycle_time_avg(self) -> float:
+        """Return the moving average of the cycle time of the update loop (in seconds)."""
+        if not self._cycle_times:
+            return 0.0
+        return sum(self._cycle_times) / len(self._cycle_times)
+
+    @property
+    def cycle_time_p95(self) -> float:
+        """Return the 95th percentile of the cycle time of the update loop (in seconds)."""
+        if not self._cycle_times:
+            return 0.0
+        cycle_times = sorted(self._cycle_times)
+        return cycle_times[math.ceil(0.95 * len(cycle_times)) - 1]
+
+    def _tune_update_interval(
+        self, schedule: Schedule, update_interval: dt.timedelta
+    ) -> dt.timedelta:
+        """Pick the shortest update interval which keeps the utilization of the serial link
+        below the target (only in 'auto' mode, otherwise just warn about a too short one).
+        """
+        if len(self._cycle_times) < AUTO_UPDATE_MIN_SAMPLES:
+            return update_interval
+        interval = update_interval.total_seconds()
+        utilization = self.cycle_time_p95 / interval
+        if not self._auto_update:
+            if utilization > 1.0 and not self._cycle_time_exceeded:
+                _LOGGER.warning(
+                    "Update interval %s is shorter than the cycle time (avg: %.3fs, p95: %.3fs)",
+                    update_interval,
+                    self.cycle_time_avg,
+                    self.cycle_time_p95,
+                )
+            self._cycle_time_exceeded = utilization > 1.0
+            return update_interval
+        new_interval = max(
+            self.cycle_time_p95 / self._target_utilization, AUTO_UPDATE_MIN_INTERVAL
+        )
+        if abs(new_interval - interval) <= AUTO_UPDATE_TOLERANCE * interval:
+            return update_interval
+        _LOGGER.info(
+            "Adjust update interval from %.1fs to %.1fs (cycle time avg: %.3fs, p95: %.3fs,"
+            " utilization: %.0f%%, target: %.0f%%)",
+            interval,
+            new_interval,
+            self.cycle_time_avg,
+            self.cycle_time_p95,
+            utilization * 100,
+            self._target_utilization * 100,
+        )
+        # data points with an own update interval are not affected
+        for name, dp in self._data_points.items():
+            if dp.update_interval is None:
+                schedule.set_interval(name, new_interval)
+        self._update_interval = dt.timedelta(seconds=new_interval)
+        return self._update_interval
+
+    def _adapt_update_interval(self, schedule: Schedule, name: str, value) -> None:
+        """Shorten the update interval of a changing data point and lengthen it for a stable one."""
+        dp = self._data_points[name]
+        if self._adaptive_update is None or dp.update_interval is not None:
+            return
+        interval = schedule.interval(name)
+        if dp.detect_change(value):
+            # react immediately on a change to keep the send on change latency low
+            new_interval = self._adaptive_update[CONF_MIN_INTERVAL].total_seconds()
+        else:
+            new_interval = min(
+                interval * ADAPTIVE_UPDATE_BACKOFF,
+                self._adaptive_update[CONF_MAX_INTERVAL].total_seconds(),
+            )
+        if new_interval != interval:
+            _LOGGER.debug(
+                "Adapt update interval of DP '%s' from %.1fs to %.1fs (changes: %d of %d updates)",
+                name,
+                interval,
+                new_interval,
+                dp.changes,
+                dp.updates,
+            )
+            schedule.set_interval(name, new_interval)
+
+    def _create_cyclic_sending_task(
+        self, cyclic_sending_interval: dt.timedelta
+    ) -> Optional[asyncio.Task]:
+        """Create an asyncio.Task for sending the heat pump parameter values periodically to the KNX bus."""
+
+        async def cyclic_sending_loop(self, cyclic_sending_interval: dt.timedelta):
+            """Endless loop for sending the heat pump parameter values to the KNX bus."""
+            loop = asyncio.get_event_loop()
+            start_time = self._start_time + self._cyclic_sending_offset.total_seconds()
+            # group the data points by their cyclic sending interval
+            groups: Dict[float, List[str]] = {}
+            for name, dp in self._data_points.items():
+                if dp.cyclic_sending:
+                    interval = dp.cyclic_sending_interval or cyclic_sending_interval
+                    groups.setdefault(interval.total_seconds(), []).append(name)
+            # in staggered mode each data point of a group gets its own phase slot within the interval
+            schedule = Schedule()
+            for interval, names in groups.items():
+                for slot, name in enumerate(names):
+                    phase = (
+                        slot * interval / len(names)
+                        if self._stagger_cyclic_sending
+                        else 0.0
+                    )
+                    schedule.add(name, interval, start_time + phase)
+            log_level = logging.DEBUG if self._stagger_cyclic_sending else logging.INFO
+            while True:
+                # wait until next run
+                deadline = schedule.next_deadline()
+                if deadline is None:
+                    return  # no data points to send cyclically
+                await asyncio.sleep(max(0.0, deadline - loop.time()))
+                now = loop.time()
+                due = schedule.due(now)
+                _LOGGER.log(
+                    log_level,
+                    "<<< [ CYCLIC SENDING (every %s%s) ] >>>",
+                    cyclic_sending_interval,
+                    ", staggered" if self._stagger_cyclic_sending else "",
+                )
+                _LOGGER.log(log_level, "Sending: %s", due)
+                # broadcast the data point values to the KNX bus
+                for name in due:
+                    await self._data_points[name].broadcast_value()
+                missed = sum(schedule.reschedule(name, now) for name in due)
+                if missed:
+                    _LOGGER.warning(
+                        "Skipped %d cyclic sending(s) of data points (total: %d)",
+                        missed,
+                        schedule.missed,
+                    )
+
+        if cyclic_sending_interval.total_seconds() > 0:
+            loop = asyncio.get_event_loop()
+            return loop.create_task(
+                cyclic_sending_loop(
+                    self, cyclic_sending_interval=cyclic_sending_interval
+                )
+            )
+        return None
+
+    def _create_synchronize_clock_task(
+        self, synchronize_clock_weekly: Optional[Dict[str, Any]]
+    ) -> Optional[asyncio.Task]:
+        """Create an asyncio.Task to synchronize the clock of the heat pump regularly."""
+
+        async def synchronize_clock_loop(
+            self, synchronize_clock_weekly: Dict[str, Any]
+        ):
+            """Endless loop to synchronize the clock of the heat pump regularly."""
+            sync_weekday = synchronize_clock_weekly[CONF_SYNCHRONIZE_CLOCK_WEEKDAY]
+            sync_time = synchronize_clock_weekly[CONF_SYNCHRONIZE_CLOCK_TIME]
+            while True:
+                # wait for the next run (once a day)
+                now = dt.datetime.now()
+                delay = dt.datetime.combine(now.date(), sync_time) - now
+                if delay.total_seconds() < 0:
+                    delay += dt.timedelta(days=1)
+                await asyncio.sleep(delay.total_seconds())
+
+                # synchronize the clock only on the defined weekday
+                if now.weekday() == WEEKDAYS.index(sync_weekday):
+                    _LOGGER.info(
+                        "<<< [ SYNCHRONIZE CLOCK (weekly on '%s' at %s) ] >>>",
+                        sync_weekday,
+                        sync_time.strftime("%H:%M:%S"),
+                    )
+                    try:
+                        # set the current date and time of the heat pump
+                        hthp_dt, _ = await self._hthp.set_date_time_async()
+                        _LOGGER.debug(hthp_dt.isoformat())
+                    except Exception as ex:
+                        _LOGGER.exception(ex)
+
+        if synchronize_clock_weekly is not None:
+            loop = asyncio.get_event_loop()
+            return loop.create_task(
+                synchronize_clock_loop(
+                    self, synchronize_clock_weekly=synchronize_clock_weekly
+                )
+            )
+        return None
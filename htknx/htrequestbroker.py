@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Prioritized single-flight access to the serial connection of the Heliotherm heat pump. """
+
+import asyncio
+import datetime
+import enum
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from htheatpump import AioHtHeatpump
+from htheatpump.htparams import HtParamValueType
+
+from . import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+
+# number of consecutive failed requests after which the serial link is considered as dead
+DEFAULT_FAILURE_THRESHOLD = 3
+# minimum and maximum delay in seconds between two reconnect attempts (exponential backoff)
+DEFAULT_RECONNECT_DELAY_MIN = 1.0
+DEFAULT_RECONNECT_DELAY_MAX = 60.0
+
+
+class HtLinkDownError(IOError):
+    """Raised for requests which are rejected because the serial link to the heat pump is down."""
+
+
+class Priority(enum.IntEnum):
+    """Priority classes of the heat pump requests (lower value means higher priority)."""
+
+    USER_WRITE = 1
+    GROUP_READ = 2
+    FAULT_CHECK = 3
+    PERIODIC = 4
+
+
+class _Request:
+    """A queued heat pump request."""
+
+    def __init__(
+        self,
+        priority: Priority,
+        key: Optional[Hashable],
+        func: Callable[..., Awaitable[Any]],
+        args: Tuple[Any, ...],
+        future: "asyncio.Future[Any]",
+        enqueued_at: float,
+    ) -> None:
+        self.priority = priority
+        self.key = key
+        self.func = func
+        self.args = args
+        self.future = future
+        self.enqueued_at = enqueued_at
+
+
+class HtRequestBroker:
+    """Central broker for all requests to the Heliotherm heat pump.
+
+    The requests are executed one after another in the order of their priority (and in the order
+    of their submission within the same priority). Identical read requests which are queued or
+    in flight are coalesced into one request to the heat pump.
+
+    If a session timeout is given, the broker logs in to the heat pump on demand: only before a
+    request if the link was idle for longer than the session timeout, or after a failed request
+    (which is then retried once).
+
+    After a number of consecutive failed requests the serial link is considered as dead: the
+    circuit opens and all requests are rejected with a :exc:`HtLinkDownError` (instead of waiting
+    for their timeouts), while the serial connection is reopened in the background with an
+    exponential backoff.
+
+    :param hthp: The heat pump to forward the requests to.
+    :type hthp: AioHtHeatpump
+    :param session_timeout: The time in seconds after which an idle session of the heat pump
+        expires (optional).
+    :type session_timeout: float
+    :param failure_threshold: The number of consecutive failed requests after which the serial
+        link is considered as dead.
+    :type failure_threshold: int
+    """
+
+    def __init__(
+        self,
+        hthp: AioHtHeatpump,
+        session_timeout: Optional[float] = None,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+    ) -> None:
+        """Initialize the HtRequestBroker class."""
+        self._hthp = hthp
+        self.session_timeout = session_timeout
+        # circuit breaker of the serial link
+        self.failure_threshold = failure_threshold
+        self.link_up = True
+        self._failures = 0  # number of consecutive failed requests
+        self._reconnect_task: Optional[asyncio.Task] = None
+        # end of the last successful exchange and start of the current session
+        self._last_activity: Optional[float] = None
+        self._session_start = 0.0
+        self._queue: "asyncio.PriorityQueue[Tuple[int, int, _Request]]" = (
+            asyncio.PriorityQueue()
+        )
+        self._seq = itertools.count()
+        self._pending: Dict[Hashable, _Request] = {}
+        self._active: Optional[_Request] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        # statistics
+        self._requests = {prio: 0 for prio in Priority}
+        self._wait_time_sum = {prio: 0.0 for prio in Priority}
+        self._wait_time_max = {prio: 0.0 for prio in Priority}
+        self._coalesced = 0
+        self._max_queue_depth = 0
+        self._logins = 0
+        self._logins_avoided = 0
+        self._relogins = 0
+        self._reconnects = 0
+        self._rejected = 0
+
+    def __del__(self):
+        """Destructor, cleaning up if this was not done before."""
+        self.stop()
+
+    def start(self) -> None:
+        """Start processing the queued requests."""
+        if self._worker_task is None:
+            loop = asyncio.get_event_loop()
+            self._worker_task = loop.create_task(self._worker())
+
+    def stop(self) -> None:
+        """Stop processing the queued requests."""
+        if self._worker_task is not None:
+            self._worker_task.cancel()
+            self._worker_task = None
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        # cancel all waiting requests
+        while not self._queue.empty():
+            _, _, req = self._queue.get_nowait()
+            req.future.cancel()
+        self._pending.clear()
+
+    def __enter__(self) -> "HtRequestBroker":
+        """Start the HtRequestBroker from context manager."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Stop the HtRequestBroker from context manager."""
+        self.stop()
+
+    @property
+    def running(self) -> bool:
+        """Return whether the queued requests are processed (the broker is started)."""
+        return self._worker_task is not None
+
+    @property
+    def queue_depth(self) -> int:
+        """Return the number of currently queued requests."""
+        return self._queue.qsize()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Return the statistics of the processed requests."""
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self._max_queue_depth,
+            "coalesced": self._coalesced,
+            "logins": self._logins,
+            "logins_avoided": self._logins_avoided,
+            "relogins": self._relogins,
+            "link_up": self.link_up,
+            "reconnects": self._reconnects,
+            "rejected": self._rejected,
+            "requests": {prio.name: cnt for prio, cnt in self._requests.items()},
+            "avg_wait_time": {
+                prio.name: round(self._wait_time_sum[prio] / cnt, 3)
+                for prio, cnt in self._requests.items()
+                if cnt > 0
+            },
+            "max_wait_time": {
+                prio.name: round(self._wait_time_max[prio], 3)
+                for prio, cnt in self._requests.items()
+                if cnt > 0
+            },
+        }
+
+    async def _worker(self) -> None:
+        """Endless loop for executing the queued requests one after another."""
+        loop = asyncio.get_event_loop()
+        while True:
+            _, _, req = await self._queue.get()
+            if req.future.done():
+                self._release(req)  # already executed with a higher priority
+                continue
+            wait_time = loop.time() - req.enqueued_at
+            self._requests[req.priority] += 1
+            self._wait_time_sum[req.priority] += wait_time
+            self._wait_time_max[req.priority] = max(
+                self._wait_time_max[req.priority], wait_time
+            )
+            self._active = req
+            start = loop.time()
+            try:
+                req.future.set_result(await self._execute(req))
+            except asyncio.CancelledError:
+                req.future.cancel()
+                raise
+            except Exception as ex:
+                req.future.set_exception(ex)
+            finally:
+                self._active = None
+                self._release(req)
+                metrics.REQUEST_DURATION.observe(
+                    loop.time() - start, req.func.__name__.strip("_")
+                )
+
+    async def _execute(self, req: _Request) -> Any:
+        """Execute a request, unless the serial link to the heat pump is down."""
+        if not self.link_up:
+            self._rejected += 1
+            raise HtLinkDownError("serial link to the heat pump is down")
+        try:
+            result = await self._execute_in_session(req)
+        except (IOError, asyncio.TimeoutError):
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._link_down()
+            raise
+        self._failures = 0
+        return result
+
+    def _link_down(self) -> None:
+        """Open the circuit and start reconnecting the serial link to the heat pump."""
+        _LOGGER.error(
+            "Serial link to the heat pump is down after %d failed requests",
+            self._failures,
+        )
+        self.link_up = False
+        self._last_activity = None
+        if self._reconnect_task is None:
+            loop = asyncio.get_event_loop()
+            self._reconnect_task = loop.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        """Reopen the serial link to the heat pump with an exponential backoff."""
+        loop = asyncio.get_event_loop()
+        down_since = loop.time()
+        delay = DEFAULT_RECONNECT_DELAY_MIN
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                self._hthp.reconnect()
+                await self._login()
+            except Exception as ex:
+                delay = min(delay * 2, DEFAULT_RECONNECT_DELAY_MAX)
+                _LOGGER.warning(
+                    "Reconnect to the heat pump failed (next try in %.1f s): %s",
+                    delay,
+                    ex,
+                )
+                continue
+            break
+        self._failures = 0
+        self._reconnects += 1
+        self._reconnect_task = None
+        self.link_up = True
+        _LOGGER.info(
+            "Serial link to the heat pump restored after %.1f s",
+            loop.time() - down_since,
+        )
+
+    async def _execute_in_session(self, req: _Request) -> Any:
+        """Execute a request, logging in to the heat pump before if necessary."""
+        if self.session_timeout is None:
+            return await req.func(*req.args)
+        await self._ensure_session()
+        try:
+            result = await req.func(*req.args)
+        except (IOError, asyncio.TimeoutError) as ex:
+            # maybe the session has expired, so login again and retry the request once
+            _LOGGER.warning("Request to heat pump failed, login again: %s", ex)
+            self._last_activity = None
+            self._relogins += 1
+            await self._login()
+            result = await req.func(*req.args)
+        self._last_activity = asyncio.get_event_loop().time()
+        return result
+
+    async def _ensure_session(self) -> None:
+        """Login to the heat pump if the link was idle for longer than the session timeout."""
+        assert self.session_timeout is not None
+        now = asyncio.get_event_loop().time()
+        if (
+            self._last_activity is None
+            or now - self._last_activity >= self.session_timeout
+        ):
+            await self._login()
+        elif now - self._session_start >= self.session_timeout:
+            # a periodic login would have been due, but the traffic kept the session alive
+            self._logins_avoided += 1
+            self._session_start = now
+
+    async def _login(self) -> None:
+        """Login to the heat pump and start a new session."""
+        try:
+            await self._hthp.login_async()
+        except Exception:
+            self._last_activity = None
+            raise
+        self._logins += 1
+        self._last_activity = self._session_start = asyncio.get_event_loop().time()
+
+    def _release(self, req: _Request) -> None:
+        """Remove a finished request from the pending requests."""
+        if req.key is not None and self._pending.get(req.key) is req:
+            del self._pending[req.key]
+
+    def _enqueue(self, req: _Request) -> None:
+        """Put a request into the priority queue."""
+        self._queue.put_nowait((req.priority, next(self._seq), req))
+        self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+
+    async def submit(
+        self,
+        priority: Priority,
+        func: Callable[..., Awaitable[Any]],
+        *args: Any,
+        key: Optional[Hashable] = None,
+    ) -> Any:
+        """Submit a request to the heat pump and wait for its result.
+
+        :param priority: The priority of the request.
+        :type priority: Priority
+        :param func: The coroutine function of :class:`~htheatpump.AioHtHeatpump` to call.
+        :type func: Callable
+        :param args: The arguments for the coroutine function.
+        :param key: A key for identical read requests which can be coalesced (optional).
+        :type key: Hashable
+        :returns: The result of the request.
+        """
+        loop = asyncio.get_event_loop()
+        req = self._pending.get(key) if key is not None else None
+        if req is not None and not req.future.done():
+            self._coalesced += 1
+            if priority < req.priority and req.future is not getattr(
+                self._active, "future", None
+            ):
+                # raise the priority of the already queued request
+                req = _Request(
+                    priority, key, req.func, req.args, req.future, req.enqueued_at
+                )
+                self._pending[key] = req
+                self._enqueue(req)
+        else:
+            req = _Request(priority, key, func, args, loop.create_future(), loop.time())
+            if key is not None:
+                self._pending[key] = req
+            self._enqueue(req)
+        # shield the shared future against the cancellation of a single waiter
+        return await asyncio.shield(req.future)
+
+    async def get_param_async(
+        self, name: str, priority: Priority = Priority.PERIODIC
+    ) -> HtParamValueType:
+        """Query for the current value of a specific parameter of the heat pump."""
+        return await self.submit(
+            priority, self._hthp.get_param_async, name, key=("get_param", name)
+        )
+
+    async def set_param_async(
+        self,
+        name: str,
+        val: HtParamValueType,
+        ignore_limits: bool = False,
+        priority: Priority = Priority.USER_WRITE,
+    ) -> HtParamValueType:
+        """Set the value of a specific parameter of the heat pump."""
+        return await self.submit(
+            priority, self._hthp.set_param_async, name, val, ignore_limits
+        )
+
+    async def fast_query_async(
+        self, *args: str, priority: Priority = Priority.PERIODIC
+    ) -> Dict[str, HtParamValueType]:
+        """Query for the current values of parameters representing a "MP" data point the fast way.
+
+        All parameters are queried with one request (bulk read of the MP data points).
+        """
+        return await self.submit(
+            priority, self._hthp.fast_query_async, *args, key=("fast_query", args)
+        )
+
+    async def get_fault_list_size_async(
+        self, priority: Priority = Priority.FAULT_CHECK
+    ) -> int:
+        """Query for the fault list size of the heat pump."""
+        return await self.submit(
+            priority, self._hthp.get_fault_list_size_async, key="get_fault_list_size"
+        )
+
+    async def get_fault_list_async(
+        self, *args: int, priority: Priority = Priority.FAULT_CHECK
+    ) -> List[Dict[str, Any]]:
+        """Query for the given entries of the fault list of the heat pump."""
+        return await self.submit(
+            priority,
+            self._hthp.get_fault_list_async,
+            *args,
+            key=("get_fault_list", args),
+        )
+
+    async def set_date_time_async(
+        self,
+        date_time: Optional[datetime.datetime] = None,
+        priority: Priority = Priority.PERIODIC,
+    ) -> Tuple[datetime.datetime, int]:
+        """Set the current date and time of the heat pump."""
+        return await self.submit(priority, self._hthp.set_date_time_async, date_time)
+
+    def __str__(self) -> str:
+        """Return object as readable string."""
+        return '<HtRequestBroker queue_depth="{}" coalesced="{}" link_up="{}"/>'.format(
+            self.queue_depth, self._coalesced, self.link_up
+        )
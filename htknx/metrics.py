@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Metrics of the gateway, provided in the Prometheus text format by a small HTTP server. """
+
+import asyncio
+import bisect
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+_LOGGER = logging.getLogger(__name__)
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# interval in seconds of the event loop lag measurement
+LOOP_LAG_INTERVAL = 1.0
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Return the labels in the Prometheus text format, e.g. ``{name="value"}``."""
+    if not names:
+        return ""
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+            for name, value in zip(names, values)
+        )
+    )
+
+
+class Counter:
+    """A monotonically increasing counter, optionally with labels.
+
+    :param name: The name of the metric.
+    :type name: str
+    :param doc: The help text of the metric.
+    :type doc: str
+    :param labels: The names of the labels of the metric.
+    :type labels: Sequence[str]
+    """
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()) -> None:
+        """Initialize the Counter class."""
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        """Increment the counter (of the given label values)."""
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        """Return the value of the counter (of the given label values)."""
+        return self._values.get(labels, 0)
+
+    def expose(self) -> List[str]:
+        """Return the lines of the metric in the Prometheus text format."""
+        lines = [
+            "# HELP {} {}".format(self.name, self.doc),
+            "# TYPE {} counter".format(self.name),
+        ]
+        for labels, value in sorted(self._values.items()):
+            lines.append(
+                "{}{} {}".format(self.name, _format_labels(self.labels, labels), value)
+            )
+        return lines
+
+
+class Histogram:
+    """A histogram of observed values (e.g. durations in seconds), optionally with labels.
+
+    :param name: The name of the metric.
+    :type name: str
+    :param doc: The help text of the metric.
+    :type doc: str
+    :param labels: The names of the labels of the metric.
+    :type labels: Sequence[str]
+    :param buckets: The upper bounds of the buckets (without ``+Inf``).
+    :type buckets: Sequence[float]
+    """
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        """Initialize the Histogram class."""
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: counts of the buckets (plus +Inf), sum and count
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        """Observe a value (of the given label values)."""
+        if labels not in self._values:
+            self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+        counts, total = self._values[labels]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+        total[1] += 1
+
+    def count(self, *labels: str) -> int:
+        """Return the number of observed values (of the given label values)."""
+        return int(self._values[labels][1][1]) if labels in self._values else 0
+
+    def expose(self) -> List[str]:
+        """Return the lines of the metric in the Prometheus text format."""
+        lines = [
+            "# HELP {} {}".format(self.name, self.doc),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, cnt in zip((*self.buckets, "+Inf"), counts):
+                cumulative += cnt
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        self.name,
+                        _format_labels((*self.labels, "le"), (*labels, str(bound))),
+                        cumulative,
+                    )
+                )
+            lines.append(
+                "{}_sum{} {}".format(
+                    self.name, _format_labels(self.labels, labels), total[0]
+                )
+            )
+            lines.append(
+                "{}_count{} {}".format(
+                    self.name, _format_labels(self.labels, labels), int(total[1])
+                )
+            )
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    "htknx_heat_pump_request_duration_seconds",
+    "Duration of the requests to the heat pump.",
+    ["request"],
+)
+UPDATE_CYCLE_DURATION = Histogram(
+    "htknx_update_cycle_duration_seconds",
+    "Time spent on the serial link for the queries of an update cycle.",
+)
+TELEGRAMS_SENT = Counter(
+    "htknx_telegrams_sent_total",
+    "Telegrams sent to the KNX bus per data point and reason.",
+    ["data_point", "reason"],
+)
+TELEGRAMS_RECEIVED = Counter(
+    "htknx_telegrams_received_total",
+    "GROUP READ and GROUP WRITE telegrams received per device.",
+    ["device", "type"],
+)
+FAULT_CHECKS = Counter(
+    "htknx_fault_checks_total",
+    "Checks of the malfunction state of the heat pump per result.",
+    ["in_error"],
+)
+LOOP_LAG = Histogram(
+    "htknx_event_loop_lag_seconds",
+    "Lag of the asyncio event loop.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+METRICS: Tuple[Union[Counter, Histogram], ...] = (
+    REQUEST_DURATION,
+    UPDATE_CYCLE_DURATION,
+    TELEGRAMS_SENT,
+    TELEGRAMS_RECEIVED,
+    FAULT_CHECKS,
+    LOOP_LAG,
+)
+
+
+def expose() -> str:
+    """Return all metrics in the Prometheus text format."""
+    return "\n".join(line for metric in METRICS for line in metric.expose()) + "\n"
+
+
+class MetricsServer:
+    """Small HTTP server which provides the metrics under the path ``/metrics``.
+
+    It also measures the lag of the event loop while it's running.
+
+    :param host: The host (ip address) to listen on.
+    :type host: str
+    :param port: The port to listen on.
+    :type port: int
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        """Initialize the MetricsServer class."""
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._loop_lag_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Start the HTTP server."""
+        if self._server is None:
+            self._server = await asyncio.start_server(
+                self._handle, self.host, self.port
+            )
+            _LOGGER.info(
+                "Metrics available at http://%s:%d/metrics", self.host, self.port
+            )
+        if self._loop_lag_task is None:
+            loop = asyncio.get_event_loop()
+            self._loop_lag_task = loop.create_task(self._measure_loop_lag())
+
+    async def stop(self) -> None:
+        """Stop the HTTP server."""
+        if self._loop_lag_task is not None:
+            self._loop_lag_task.cancel()
+            self._loop_lag_task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self) -> "MetricsServer":
+        """Start the MetricsServer from context manager."""
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        """Stop the MetricsServer from context manager."""
+        await self.stop()
+
+    async def _measure_loop_lag(self) -> None:
+        """Endless loop to measure the lag of the event loop."""
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            LOOP_LAG.observe(max(0.0, loop.time() - start - LOOP_LAG_INTERVAL))
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answer a HTTP request."""
+        try:
+            request = await reader.readline()
+            # skip the headers of the request
+            while (await reader.readline()).strip():
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1] == "/metrics":
+                status = "200 OK"
+                body = expose().encode()
+            else:
+                status = "404 Not Found"
+                body = b"Not Found\n"
+            writer.write(
+                "HTTP/1.1 {}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                "Content-Length: {}\r\n"
+                "Connection: close\r\n\r\n".format(status, len(body)).encode() + body
+            )
+            await writer.drain()
+        except Exception as ex:
+            _LOGGER.warning("Failed to answer metrics request: %s", ex)
+        finally:
+            writer.close()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Helpers for scheduling periodic work on the monotonic clock of the event loop. """
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+
+def next_deadline(deadline: float, interval: float, now: float) -> Tuple[float, int]:
+    """Return the next deadline on the fixed-rate grid after `now` and the number of missed deadlines.
+
+    The grid is given by the last `deadline` and the `interval`. Deadlines which are already
+    more than one interval in the past are skipped (and counted) instead of being caught up.
+    """
+    deadline += interval
+    missed = 0
+    if now - deadline >= interval:
+        missed = math.floor((now - deadline) / interval)
+        deadline += missed * interval
+    return deadline, missed
+
+
+class Schedule:
+    """Deadlines of items which are due periodically, each with its own interval.
+
+    All times are given in seconds on a monotonic clock, e.g. :meth:`asyncio.AbstractEventLoop.time`.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the Schedule class."""
+        self._intervals: Dict[str, float] = {}
+        self._deadlines: Dict[str, float] = {}
+        self.missed = 0
+
+    def __len__(self) -> int:
+        """Return the number of scheduled items."""
+        return len(self._intervals)
+
+    def __contains__(self, key: str) -> bool:
+        """Return whether the item `key` is scheduled."""
+        return key in self._intervals
+
+    def add(self, key: str, interval: float, deadline: float) -> None:
+        """Add an item which is due for the first time at `deadline` and then every `interval` seconds."""
+        assert interval > 0, "interval must be greater zero"
+        self._intervals[key] = interval
+        self._deadlines[key] = deadline
+
+    def interval(self, key: str) -> float:
+        """Return the interval of the item `key`."""
+        return self._intervals[key]
+
+    def set_interval(self, key: str, interval: float) -> None:
+        """Change the interval of the item `key` (effective with its next rescheduling)."""
+        assert interval > 0, "interval must be greater zero"
+        self._intervals[key] = interval
+
+    def due(self, now: float) -> List[str]:
+        """Return the items which are due at `now`."""
+        return [key for key, deadline in self._deadlines.items() if deadline <= now]
+
+    def reschedule(self, key: str, now: float) -> int:
+        """Schedule the next run of the item `key` on its fixed-rate grid after `now`.
+
+        :returns: The number of skipped runs of the item.
+        """
+        self._deadlines[key], missed = next_deadline(
+            self._deadlines[key], self._intervals[key], now
+        )
+        self.missed += missed
+        return missed
+
+    def next_deadline(self) -> Optional[float]:
+        """Return the earliest deadline of all items or ``None`` if the schedule is empty."""
+        return min(self._deadlines.values(), default=None)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Persistent snapshot of the data point states for a warm start of the gateway. """
+
+import asyncio
+import datetime as dt
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, Optional
+
+from .htdatapoint import HtDataPoint
+
+_LOGGER = logging.getLogger(__name__)
+
+# keys of the data point state which only tell how fresh the value is (see 'HtDataPoint.get_state')
+FRESHNESS_KEYS = ("updated_at",)
+
+
+class StateStore:
+    """Periodically persist the state of the data points to a local file and restore it at startup.
+
+    The file is written atomically (to a temporary file which replaces the old one) and only
+    if the state has changed since it was written the last time (a newer time of the last
+    update of a value alone isn't a change).
+
+    :param filename: The name of the state file.
+    :type filename: str
+    :param data_points: The data points whose state should be persisted.
+    :type data_points: Dict[str, HtDataPoint]
+    :param save_interval: The interval to persist the state.
+    :type save_interval: datetime.timedelta
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        data_points: Dict[str, HtDataPoint],
+        save_interval: dt.timedelta,
+    ) -> None:
+        """Initialize the StateStore class."""
+        self.filename = filename
+        self._data_points = data_points
+        self._save_interval = save_interval
+        self._save_task: Optional[asyncio.Task] = None
+        self._last_saved: Optional[str] = None
+
+    def __del__(self):
+        """Destructor, cleaning up if this was not done before."""
+        if self._save_task is not None:
+            self._save_task.cancel()
+
+    def start(self) -> None:
+        """Start persisting the state periodically."""
+        if self._save_task is None and self._save_interval.total_seconds() > 0:
+            loop = asyncio.get_event_loop()
+            self._save_task = loop.create_task(self._save_loop())
+
+    def stop(self) -> None:
+        """Stop persisting the state periodically and persist it a last time."""
+        if self._save_task is not None:
+            self._save_task.cancel()
+            self._save_task = None
+        self.save()
+
+    def __enter__(self) -> "StateStore":
+        """Start the StateStore from context manager."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Stop the StateStore from context manager."""
+        self.stop()
+
+    async def _save_loop(self) -> None:
+        """Endless loop for persisting the state periodically."""
+        while True:
+            await asyncio.sleep(self._save_interval.total_seconds())
+            self.save()
+
+    def load(self) -> None:
+        """Restore the state of the data points from the state file (if there is one)."""
+        try:
+            with open(self.filename, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            _LOGGER.info("No state file '%s' found, cold start", self.filename)
+            return
+        except Exception as ex:
+            _LOGGER.warning("Failed to read state file '%s': %s", self.filename, ex)
+            return
+        restored = 0
+        for name, dp_state in state.items():
+            dp = self._data_points.get(name)
+            if dp is None:
+                continue
+            try:
+                dp.restore_state(dp_state)
+                restored += 1
+            except Exception as ex:
+                _LOGGER.warning("Failed to restore state of DP '%s': %s", name, ex)
+        _LOGGER.info(
+            "Restored state of %d data point(s) from '%s'", restored, self.filename
+        )
+
+    def save(self) -> None:
+        """Persist the state of the data points to the state file (if it has changed)."""
+        state = {name: dp.get_state() for name, dp in self._data_points.items()}
+        data = json.dumps(state, separators=(",", ":"))
+        # the time of the last update changes with each poll, so it doesn't count as a change
+        content = json.dumps(
+            {
+                name: {k: v for k, v in dp_state.items() if k not in FRESHNESS_KEYS}
+                for name, dp_state in state.items()
+            },
+            separators=(",", ":"),
+        )
+        if content == self._last_saved:
+            return
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".htknx-state-")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(data)
+                os.replace(tmpname, self.filename)
+            except Exception:
+                os.unlink(tmpname)
+                raise
+        except Exception as ex:
+            _LOGGER.warning("Failed to write state file '%s': %s", self.filename, ex)
+            return
+        self._last_saved = content
+        _LOGGER.debug("Saved state to '%s'", self.filename)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Routing of KNX telegrams to the devices of the gateway by an index of their group addresses. """
+
+import logging
+from typing import Dict, Iterator, List
+
+from xknx.devices import Device, Devices
+from xknx.telegram import GroupAddress, Telegram, TelegramDirection
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class TelegramRouter(Devices):
+    """Replacement of :class:`xknx.devices.Devices` which dispatches telegrams by an index.
+
+    Instead of asking every registered device whether it owns the destination group address
+    of a telegram, the owning devices are looked up in a dictionary. Telegrams for group
+    addresses which aren't used by the gateway are dropped immediately.
+
+    The devices must be registered with all of their group addresses by :meth:`route`.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the TelegramRouter class."""
+        super().__init__()
+        self._routes: Dict[GroupAddress, List[Device]] = {}
+        self.dispatched = 0  # number of received telegrams dispatched to a device
+        self.filtered = 0  # number of received telegrams for unrelated group addresses
+
+    def route(self, group_address: GroupAddress, device: Device) -> None:
+        """Dispatch the telegrams of the given group address to the device."""
+        devices = self._routes.setdefault(group_address, [])
+        if device not in devices:
+            devices.append(device)
+
+    def devices_by_group_address(self, group_address: GroupAddress) -> Iterator[Device]:
+        """Return device(s) by group address."""
+        yield from self._routes.get(group_address, ())
+
+    async def process(self, telegram: Telegram) -> None:
+        """Process telegram."""
+        devices = None
+        if isinstance(telegram.destination_address, GroupAddress):
+            devices = self._routes.get(telegram.destination_address)
+        # XKNX passes the own outgoing telegrams to the devices as well, they aren't counted
+        incoming = telegram.direction == TelegramDirection.INCOMING
+        if not devices:
+            if incoming:
+                self.filtered += 1
+            return
+        if incoming:
+            self.dispatched += 1
+        for device in devices:
+            await device.process(telegram)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Return the statistics of the routed telegrams."""
+        return {"dispatched": self.dispatched, "filtered": self.filtered}
+
+    def __str__(self) -> str:
+        """Return object as readable string."""
+        return '<TelegramRouter routes="{}" dispatched="{}" filtered="{}"/>'.format(
+            len(self._routes), self.dispatched, self.filtered
+        )
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Shared fixtures of the tests. """
+
+import asyncio
+import datetime
+from typing import Any, Dict, List, Set
+
+import pytest
+
+
+class FakeHeatPump:
+    """Minimal stand-in for :class:`~htheatpump.AioHtHeatpump` which records the calls.
+
+    The value of a parameter is taken from :attr:`params` (or is its lowercase name), the
+    queries of the parameters in :attr:`failing` fail with an ``IOError``.
+    """
+
+    def __init__(self) -> None:
+        self.calls: List[Any] = []
+        self.params: Dict[str, Any] = {}
+        self.failing: Set[str] = set()
+        self.fault_list_size = 0
+        self.fetched: List[Any] = []  # the indices of the fetched fault list entries
+
+    def _value(self, name: str) -> Any:
+        if name in self.failing:
+            raise IOError(f"query of {name!r} failed")
+        return self.params.get(name, name.lower())
+
+    async def get_param_async(self, name: str) -> Any:
+        self.calls.append(name)
+        await asyncio.sleep(0)
+        return self._value(name)
+
+    async def fast_query_async(self, *names: str) -> Dict[str, Any]:
+        self.calls.append(("fast_query",) + names)
+        await asyncio.sleep(0)
+        return {name: self._value(name) for name in names}
+
+    async def set_param_async(self, name: str, val: Any, ignore_limits: bool) -> Any:
+        self.calls.append(("set", name, val))
+        await asyncio.sleep(0)
+        self.params[name] = val
+        return val
+
+    async def login_async(self) -> None:
+        self.calls.append("login")
+
+    def reconnect(self) -> None:
+        self.calls.append("reconnect")
+
+    async def get_fault_list_size_async(self) -> int:
+        return self.fault_list_size
+
+    async def get_fault_list_async(self, *args: int) -> List[Dict[str, Any]]:
+        self.fetched.append(args)
+        return [
+            {
+                "index": idx,
+                "error": 20,
+                "datetime": datetime.datetime(2021, 1, 1),
+                "message": f"fault #{idx}",
+            }
+            for idx in args
+        ]
+
+
+@pytest.fixture
+def hthp() -> FakeHeatPump:
+    """Return a fake heat pump (to be wrapped by a request broker)."""
+    return FakeHeatPump()
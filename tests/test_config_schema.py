@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for the schema of the config file. """
+
+import datetime as dt
+
+import pytest
+import voluptuous as vol
+
+from htknx.config_schema import DATA_POINT_SCHEMA
+
+
+def test_send_filters():
+    dp = DATA_POINT_SCHEMA(
+        {
+            "value_type": "temperature",
+            "group_address": "1/2/3",
+            "send_on_change": True,
+            "on_change_of_absolute": 0.5,
+            "min_send_interval": 30,
+            "max_silence": "00:15",
+            "hysteresis": 0.2,
+        }
+    )
+    assert dp["min_send_interval"] == dt.timedelta(seconds=30)
+    assert dp["max_silence"] == dt.timedelta(minutes=15)
+    assert dp["hysteresis"] == 0.2
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"min_send_interval": "00:15", "max_silence": 30},
+        {"min_send_interval": 0},
+        {"hysteresis": 0},
+    ],
+)
+def test_invalid_send_filters(options):
+    with pytest.raises(vol.Invalid):
+        DATA_POINT_SCHEMA(
+            {"value_type": "temperature", "group_address": "1/2/3", **options}
+        )
+
+
+def test_hysteresis_not_allowed_for_binary_data_point():
+    with pytest.raises(vol.Invalid):
+        DATA_POINT_SCHEMA(
+            {"value_type": "binary", "group_address": "1/2/3", "hysteresis": 0.5}
+        )
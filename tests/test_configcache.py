@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for the cache of the validated gateway settings. """
+
+import datetime as dt
+import json
+import os
+import sys
+
+from htknx import configcache
+from htknx.config import Config
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), "..", "htknx", "htknx.yaml")
+
+
+def test_round_trip(tmp_path):
+    cache_file = str(tmp_path / "config.cache")
+    doc = {
+        "general": {
+            "update_interval": dt.timedelta(seconds=90),
+            "synchronize_clock_weekly": {"weekday": 6, "time": dt.time(3, 15)},
+        },
+        "data_points": {"1/2/3": {"name": "Temp. Aussen", "writable": False}},
+    }
+    configcache.write_cache(cache_file, "key", doc)
+    assert configcache.read_cache(cache_file, "key") == doc
+
+
+def test_outdated_key(tmp_path):
+    cache_file = str(tmp_path / "config.cache")
+    configcache.write_cache(cache_file, "key", {"general": {}})
+    assert configcache.read_cache(cache_file, "other key") is None
+
+
+def test_missing_or_invalid_cache_file(tmp_path):
+    cache_file = tmp_path / "config.cache"
+    assert configcache.read_cache(str(cache_file), "key") is None
+    cache_file.write_text("no JSON")
+    assert configcache.read_cache(str(cache_file), "key") is None
+    cache_file.write_text(json.dumps({"settings": {}}))
+    assert configcache.read_cache(str(cache_file), "key") is None
+
+
+def test_cache_key():
+    assert configcache.cache_key(b"a: 1") == configcache.cache_key(b"a: 1")
+    assert configcache.cache_key(b"a: 1") != configcache.cache_key(b"a: 2")
+
+
+def test_config_read_with_cache(tmp_path):
+    cache_file = str(tmp_path / "config.cache")
+    expected = Config()
+    expected.read(CONFIG_FILE)
+    # the first read fills the cache, the second one uses it
+    for _ in range(2):
+        config = Config()
+        config.read(CONFIG_FILE, cache_file=cache_file)
+        assert os.path.exists(cache_file)
+        assert vars(config) == vars(expected)
+
+
+def test_package_version(monkeypatch):
+    from xknx.__version__ import __version__ as xknx_version
+
+    assert configcache._package_version("xknx") == xknx_version
+    assert configcache._package_version("no-such-package") == "unknown"
+    # Python 3.7 (without importlib.metadata)
+    monkeypatch.setitem(sys.modules, "importlib.metadata", None)
+    assert configcache._package_version("xknx") == xknx_version
+    assert configcache._package_version("no-such-package") == "unknown"
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for the representation of a heat pump parameter as a data point. """
+
+import asyncio
+import datetime as dt
+from typing import List
+
+from xknx import XKNX
+from xknx.telegram import GroupAddress, Telegram, TelegramDirection
+from xknx.telegram.apci import GroupValueWrite
+
+from htknx.htdatapoint import HtDataPoint
+from htknx.htrequestbroker import HtRequestBroker
+
+
+def _data_point(
+    xknx: XKNX,
+    broker: HtRequestBroker,
+    name: str = "Temp. Aussen",
+    value_type: str = "temperature",
+    **kwargs,
+) -> HtDataPoint:
+    return HtDataPoint(xknx, broker, name, "1/2/3", value_type, **kwargs)
+
+
+def _sent(xknx: XKNX) -> List[Telegram]:
+    """Return the telegrams queued for sending."""
+    telegrams = []
+    while not xknx.telegrams.empty():
+        telegrams.append(xknx.telegrams.get_nowait())
+    return telegrams
+
+
+def _sent_values(xknx: XKNX, dp: HtDataPoint) -> List[float]:
+    """Return the values of the telegrams queued for sending."""
+    return [dp.param_value.from_knx(t.payload.value) for t in _sent(xknx)]
+
+
+async def _group_write(dp: HtDataPoint, value) -> None:
+    await dp.process_group_write(
+        Telegram(
+            destination_address=GroupAddress("1/2/3"),
+            direction=TelegramDirection.INCOMING,
+            payload=GroupValueWrite(dp.param_value.to_knx(value)),
+        )
+    )
+
+
+def test_write_debounce(hthp):
+    async def run():
+        xknx = XKNX()
+        with HtRequestBroker(hthp) as broker:
+            dp = _data_point(
+                xknx,
+                broker,
+                "HKR Soll_Raum",
+                writable=True,
+                write_debounce=dt.timedelta(seconds=0.05),
+            )
+            for value in (20.0, 21.0, 22.0):
+                await _group_write(dp, value)
+                await asyncio.sleep(0.01)
+            assert hthp.calls == []
+            await asyncio.sleep(0.1)
+            return dp, _sent_values(xknx, dp)
+
+    dp, sent = asyncio.run(run())
+    # only the last value is written, and the written value is sent back
+    assert hthp.calls == [("set", "HKR Soll_Raum", 22.0)]
+    assert sent == [22.0]
+    assert dp.raw_value == 22.0
+    assert dp.param_value.value == 22.0
+
+
+def test_write_without_debounce(hthp):
+    async def run():
+        xknx = XKNX()
+        with HtRequestBroker(hthp) as broker:
+            dp = _data_point(xknx, broker, "HKR Soll_Raum", writable=True)
+            for value in (20.0, 21.0):
+                await _group_write(dp, value)
+            return _sent(xknx)
+
+    assert asyncio.run(run()) == []
+    assert hthp.calls == [
+        ("set", "HKR Soll_Raum", 20.0),
+        ("set", "HKR Soll_Raum", 21.0),
+    ]
+
+
+def test_min_send_interval(hthp):
+    async def run():
+        xknx = XKNX()
+        dp = _data_point(
+            xknx,
+            HtRequestBroker(hthp),
+            send_on_change=True,
+            on_change_of_absolute=0.5,
+            min_send_interval=dt.timedelta(seconds=0.05),
+        )
+        await dp.set(20.0)
+        await dp.set(21.0)  # throttled
+        await dp.send_due()
+        assert _sent_values(xknx, dp) == [20.0]
+        await asyncio.sleep(0.06)
+        await dp.send_due()  # the pending change is sent now
+        await dp.send_due()
+        return _sent_values(xknx, dp)
+
+    assert asyncio.run(run()) == [21.0]
+
+
+def test_max_silence(hthp):
+    async def run():
+        xknx = XKNX()
+        dp = _data_point(
+            xknx,
+            HtRequestBroker(hthp),
+            send_on_change=True,
+            on_change_of_absolute=0.5,
+            max_silence=dt.timedelta(seconds=0.05),
+        )
+        await dp.set(20.0)
+        await dp.set(20.2)  # below the threshold
+        await dp.send_due()
+        assert _sent_values(xknx, dp) == [20.0]
+        await asyncio.sleep(0.06)
+        await dp.send_due()  # heartbeat with the current value
+        await dp.send_due()
+        return _sent_values(xknx, dp)
+
+    assert asyncio.run(run()) == [20.2]
+
+
+def test_hysteresis(hthp):
+    async def run():
+        xknx = XKNX()
+        dp = _data_point(
+            xknx,
+            HtRequestBroker(hthp),
+            send_on_change=True,
+            on_change_of_absolute=1.0,
+            hysteresis=0.5,
+        )
+        # a change against the direction of the last sent change must exceed the threshold
+        # plus the hysteresis
+        for value in (20.0, 21.0, 20.0, 19.6, 19.5, 18.5):
+            await dp.set(value)
+        return _sent_values(xknx, dp)
+
+    assert asyncio.run(run()) == [20.0, 21.0, 19.5, 18.5]
+
+
+def test_compare_payload(hthp):
+    async def run():
+        xknx = XKNX()
+        dp = _data_point(
+            xknx,
+            HtRequestBroker(hthp),
+            send_on_change=True,
+            on_change_of_absolute=0.001,
+            compare_payload=True,
+        )
+        # the changes below the resolution of DPT-9 result in the same payload
+        for value in (20.0, 20.001, 20.004, 20.01):
+            await dp.set(value)
+        return _sent_values(xknx, dp)
+
+    assert asyncio.run(run()) == [20.0, 20.01]
+
+
+def test_cyclic_sending_skips_the_sent_payload(hthp):
+    async def run():
+        xknx = XKNX()
+        dp = _data_point(
+            xknx,
+            HtRequestBroker(hthp),
+            cyclic_sending=True,
+            send_on_change=True,
+            on_change_of_absolute=0.5,
+            compare_payload=True,
+        )
+        await dp.set(20.0)
+        # the value was already sent since the last cyclic sending
+        await dp.broadcast_value()
+        assert _sent_values(xknx, dp) == [20.0]
+        await dp.broadcast_value()
+        return _sent_values(xknx, dp)
+
+    assert asyncio.run(run()) == [20.0]
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for the cached fault list of the heat pump. """
+
+import asyncio
+
+from htknx.htfaultlog import HtFaultLog
+from htknx.htrequestbroker import HtRequestBroker
+
+
+def test_initial_update_fetches_only_the_cached_entries(hthp):
+    async def run():
+        with HtRequestBroker(hthp) as broker:
+            fault_log = HtFaultLog(broker, max_size=10)
+            assert fault_log.last is None
+            return fault_log, await fault_log.update()
+
+    hthp.fault_list_size = 25
+    fault_log, new = asyncio.run(run())
+    assert [e["index"] for e in new] == list(range(15, 25))
+    assert hthp.fetched == [tuple(range(15, 25))]
+    assert fault_log.cursor == 25
+    assert fault_log.last is not None and fault_log.last["index"] == 24
+    assert fault_log.fetched == 10
+
+
+def test_incremental_update(hthp):
+    async def run():
+        with HtRequestBroker(hthp) as broker:
+            fault_log = HtFaultLog(broker, max_size=4)
+            await fault_log.update()
+            # nothing new: only the size is queried
+            assert await fault_log.update() == []
+            assert hthp.fetched == [(0, 1, 2)]
+            hthp.fault_list_size = 5
+            return fault_log, await fault_log.update()
+
+    hthp.fault_list_size = 3
+    fault_log, new = asyncio.run(run())
+    assert [e["index"] for e in new] == [3, 4]
+    assert hthp.fetched[-1] == (3, 4)
+    # the oldest entries are dropped from the cache
+    assert [e["index"] for e in fault_log.entries] == [1, 2, 3, 4]
+    assert fault_log.cursor == 5
+
+
+def test_cleared_fault_list(hthp):
+    async def run():
+        with HtRequestBroker(hthp) as broker:
+            fault_log = HtFaultLog(broker)
+            await fault_log.update()
+            hthp.fault_list_size = 1
+            return fault_log, await fault_log.update()
+
+    hthp.fault_list_size = 3
+    fault_log, new = asyncio.run(run())
+    assert [e["index"] for e in new] == [0]
+    assert [e["index"] for e in fault_log.entries] == [0]
+    assert fault_log.cursor == 1
+
+
+def test_empty_fault_list(hthp):
+    async def run():
+        with HtRequestBroker(hthp) as broker:
+            fault_log = HtFaultLog(broker)
+            return fault_log, await fault_log.update()
+
+    hthp.fault_list_size = 0
+    fault_log, new = asyncio.run(run())
+    assert new == []
+    assert hthp.fetched == []
+    assert fault_log.cursor == 0
+    assert fault_log.last is None
+
+
+def test_concurrent_updates_are_coalesced(hthp):
+    async def run():
+        with HtRequestBroker(hthp) as broker:
+            fault_log = HtFaultLog(broker)
+            return await asyncio.gather(fault_log.update(), fault_log.update())
+
+    hthp.fault_list_size = 2
+    results = asyncio.run(run())
+    assert results[0] == results[1]
+    assert hthp.fetched == [(0, 1)]
+
+
+def test_is_outdated(hthp):
+    async def run():
+        with HtRequestBroker(hthp) as broker:
+            fault_log = HtFaultLog(broker)
+            assert fault_log.is_outdated(10.0)
+            await fault_log.update()
+            assert not fault_log.is_outdated(10.0)
+            assert fault_log.is_outdated(-1.0)
+
+    asyncio.run(run())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for the notification about malfunctioning of the heat pump. """
+
+import asyncio
+import datetime as dt
+from typing import List
+
+from xknx import XKNX
+from xknx.telegram import GroupAddress, Telegram, TelegramDirection
+from xknx.telegram.apci import GroupValueRead, GroupValueResponse, GroupValueWrite
+
+from htknx.htfaultnotification import HtFaultNotification
+from htknx.htrequestbroker import HtRequestBroker
+
+
+def _notification(xknx: XKNX, broker: HtRequestBroker) -> HtFaultNotification:
+    return HtFaultNotification(
+        xknx,
+        broker,
+        "Fault",
+        group_address="1/0/0",
+        repeat_after=None,
+        fault_count_group_address="1/0/1",
+        fault_index_group_address="1/0/2",
+    )
+
+
+def _sent(xknx: XKNX) -> List[Telegram]:
+    """Return the telegrams queued for sending."""
+    telegrams = []
+    while not xknx.telegrams.empty():
+        telegrams.append(xknx.telegrams.get_nowait())
+    return telegrams
+
+
+async def _group_read(notif: HtFaultNotification, ga: str) -> None:
+    await notif.process_group_read(
+        Telegram(
+            destination_address=GroupAddress(ga),
+            direction=TelegramDirection.INCOMING,
+            payload=GroupValueRead(),
+        )
+    )
+    await asyncio.sleep(0.01)  # answered in a separate task
+
+
+def test_update_sends_counters_and_message(hthp):
+    async def run():
+        xknx = XKNX()
+        with HtRequestBroker(hthp) as broker:
+            notif = _notification(xknx, broker)
+            await notif.update(True)
+            first = _sent(xknx)
+            # no new fault and no repetition: nothing is sent
+            await notif.update(True)
+            return first, _sent(xknx)
+
+    hthp.fault_list_size = 3
+    first, second = asyncio.run(run())
+    assert [(str(t.destination_address), type(t.payload)) for t in first] == [
+        ("1/0/1", GroupValueWrite),
+        ("1/0/2", GroupValueWrite),
+        ("1/0/0", GroupValueWrite),
+    ]
+    assert second == []
+
+
+def test_group_read_is_only_answered(hthp):
+    async def run():
+        xknx = XKNX()
+        with HtRequestBroker(hthp) as broker:
+            notif = _notification(xknx, broker)
+            await notif.update(True)
+            _sent(xknx)
+            # a new fault is fetched for the GROUP READ, but only the response is sent
+            hthp.fault_list_size = 4
+            notif.fault_log.updated_at = None
+            await _group_read(notif, "1/0/1")
+            await _group_read(notif, "1/0/0")
+            responses = _sent(xknx)
+            # the changed counters are sent with the next update
+            notif.repeat_after = dt.timedelta(0)
+            await notif.update(True)
+            return responses, _sent(xknx)
+
+    hthp.fault_list_size = 3
+    responses, writes = asyncio.run(run())
+    assert [(str(t.destination_address), type(t.payload)) for t in responses] == [
+        ("1/0/1", GroupValueResponse),
+        ("1/0/0", GroupValueResponse),
+    ]
+    assert responses[0].payload.value.value == (0, 4)
+    assert [str(t.destination_address) for t in writes] == ["1/0/1", "1/0/2", "1/0/0"]
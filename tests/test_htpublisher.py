@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for the periodical update and publishing of the heat pump data points. """
+
+import asyncio
+import datetime as dt
+from typing import List, Tuple
+
+import pytest
+from xknx import XKNX
+from xknx.telegram import Telegram
+
+from htknx import htpublisher
+from htknx.config import CONF_MAX_INTERVAL, CONF_MIN_INTERVAL
+from htknx.htdatapoint import HtDataPoint
+from htknx.htfaultnotification import FAULT_PARAM, HtFaultNotification
+from htknx.htpublisher import HtPublisher
+from htknx.htrequestbroker import HtRequestBroker
+from htknx.scheduler import Schedule
+
+
+def _data_point(
+    xknx: XKNX,
+    broker: HtRequestBroker,
+    name: str = "Temp. Aussen",
+    group_address: str = "1/2/3",
+    value_type: str = "temperature",
+    **kwargs,
+) -> HtDataPoint:
+    return HtDataPoint(xknx, broker, name, group_address, value_type, **kwargs)
+
+
+def _publisher(broker: HtRequestBroker, *data_points: HtDataPoint, **kwargs):
+    kwargs.setdefault("update_interval", dt.timedelta(seconds=60))
+    kwargs.setdefault("cyclic_sending_interval", dt.timedelta(0))
+    return HtPublisher(
+        broker,
+        {dp.name: dp for dp in data_points},
+        kwargs.pop("notifications", {}),
+        synchronize_clock_weekly=None,
+        **kwargs,
+    )
+
+
+def _sent(xknx: XKNX) -> List[Telegram]:
+    """Return the telegrams queued for sending."""
+    telegrams = []
+    while not xknx.telegrams.empty():
+        telegrams.append(xknx.telegrams.get_nowait())
+    return telegrams
+
+
+def test_unchanged_values_are_skipped(hthp):
+    async def run():
+        xknx = XKNX()
+        broker = HtRequestBroker(hthp)
+        dp = _data_point(xknx, broker, send_on_change=True, on_change_of_absolute=0.5)
+        publisher = _publisher(broker, dp)
+        await publisher._publish({dp.name: 20.0})
+        updated_at = dp.updated_at
+        await asyncio.sleep(0.01)
+        await publisher._publish({dp.name: 20.0})
+        assert dp.updated_at > updated_at
+        return publisher, _sent(xknx)
+
+    publisher, telegrams = asyncio.run(run())
+    assert len(telegrams) == 1
+    assert (publisher._changed_values, publisher._unchanged_values) == (1, 1)
+
+
+def test_sent_value_is_kept_for_unchanged_values(hthp):
+    async def run():
+        xknx = XKNX()
+        broker = HtRequestBroker(hthp)
+        dp = _data_point(xknx, broker, send_on_change=True, on_change_of_absolute=0.5)
+        publisher = _publisher(broker, dp)
+        for value in (20.0, 20.2, 21.0, 21.0):
+            await publisher._publish({dp.name: value})
+        assert [t.payload.value for t in _sent(xknx)] == [
+            dp.param_value.to_knx(20.0),
+            dp.param_value.to_knx(21.0),
+        ]
+        # a GROUP READ (like a cyclic sending or heartbeat) must send the last value
+        await dp.broadcast_value(True)
+        return dp, _sent(xknx)
+
+    dp, telegrams = asyncio.run(run())
+    assert dp.param_value.value == 21.0
+    assert [t.payload.value for t in telegrams] == [dp.param_value.to_knx(21.0)]
+
+
+def test_cycle_time_excludes_the_connection_setup(hthp):
+    async def run():
+        broker = HtRequestBroker(hthp)
+        dp = _data_point(XKNX(), broker)
+        publisher = _publisher(broker, dp, update_interval=dt.timedelta(seconds=0.05))
+        with publisher:
+            # the first update cycle waits for the start of the request broker
+            await asyncio.sleep(0.2)
+            with broker:
+                await asyncio.sleep(0.12)
+        return publisher
+
+    publisher = asyncio.run(run())
+    assert len(publisher._cycle_times) >= 1
+    assert publisher.cycle_time_p95 < 0.1
+
+
+def _queried(hthp) -> List[str]:
+    """Return the names of the queried parameters (in bulk or single)."""
+    names: List[str] = []
+    for call in hthp.calls:
+        if isinstance(call, tuple) and call[0] == "fast_query":
+            names.extend(call[1:])
+        elif isinstance(call, str):
+            names.append(call)
+    return names
+
+
+def test_update_intervals(hthp):
+    async def run():
+        xknx = XKNX()
+        with HtRequestBroker(hthp) as broker:
+            fast = _data_point(xknx, broker, update_interval=dt.timedelta(seconds=0.05))
+            slow = _data_point(xknx, broker, "Temp. Vorlauf", "1/2/4")
+            publisher = _publisher(
+                broker, fast, slow, update_interval=dt.timedelta(seconds=0.2)
+            )
+            with publisher:
+                await asyncio.sleep(0.225)
+
+    asyncio.run(run())
+    queried = _queried(hthp)
+    # the due data points of a cycle are queried with one batched query
+    assert hthp.calls[0] == ("fast_query", "Temp. Aussen", "Temp. Vorlauf")
+    assert queried.count("Temp. Aussen") == 5
+    assert queried.count("Temp. Vorlauf") == 2
+
+
+def test_adaptive_update(hthp):
+    async def run():
+        xknx = XKNX()
+        broker = HtRequestBroker(hthp)
+        dp = _data_point(xknx, broker, on_change_of_absolute=0.5)
+        fixed = _data_point(
+            xknx, broker, "Temp. Vorlauf", "1/2/4", update_interval=dt.timedelta(10)
+        )
+        publisher = _publisher(
+            broker,
+            dp,
+            fixed,
+            adaptive_update={
+                CONF_MIN_INTERVAL: dt.timedelta(seconds=10),
+                CONF_MAX_INTERVAL: dt.timedelta(seconds=40),
+            },
+        )
+        schedule = Schedule()
+        schedule.add(dp.name, 20.0, 0.0)
+        schedule.add(fixed.name, 20.0, 0.0)
+        intervals = []
+        for value in (20.0, 20.0, 20.2, 20.0, 20.0, 20.0, 21.0):
+            publisher._adapt_update_interval(schedule, dp.name, value)
+            publisher._adapt_update_interval(schedule, fixed.name, value)
+            intervals.append(schedule.interval(dp.name))
+        assert schedule.interval(fixed.name) == 20.0
+        return intervals
+
+    # shortened on a change, lengthened by the backoff factor up to the maximum otherwise
+    assert asyncio.run(run()) == [10.0, 15.0, 22.5, 33.75, 40.0, 40.0, 10.0]
+
+
+def _query(hthp, names: List[str], fast_query: bool = True):
+    async def run():
+        with HtRequestBroker(hthp, failure_threshold=100) as broker:
+            dps = [
+                _data_point(XKNX(), broker, name, f"1/2/{i}")
+                for i, name in enumerate(names)
+            ]
+            publisher = _publisher(broker, *dps, fast_query=fast_query)
+            return publisher, await publisher._query(names)
+
+    return asyncio.run(run())
+
+
+def test_fast_query(hthp):
+    hthp.params.update({"Temp. Aussen": 5.0, "HKR Soll_Raum": 21.0})
+    _, (params, failed) = _query(hthp, ["Temp. Aussen", "HKR Soll_Raum"])
+    assert params == {"Temp. Aussen": 5.0, "HKR Soll_Raum": 21.0}
+    assert failed == []
+    # only the "MP" data points can be read with the fast query
+    assert hthp.calls == [("fast_query", "Temp. Aussen"), "HKR Soll_Raum"]
+
+
+def test_fast_query_disabled(hthp):
+    _query(hthp, ["Temp. Aussen", "HKR Soll_Raum"], fast_query=False)
+    assert hthp.calls == ["Temp. Aussen", "HKR Soll_Raum"]
+
+
+def test_fast_query_fallback(hthp):
+    hthp.failing.add("Temp. Vorlauf")
+    publisher, (params, failed) = _query(hthp, ["Temp. Aussen", "Temp. Vorlauf"])
+    # the failed fast query falls back to single queries
+    assert hthp.calls == [
+        ("fast_query", "Temp. Aussen", "Temp. Vorlauf"),
+        "Temp. Aussen",
+        "Temp. Vorlauf",
+    ]
+    assert params == {"Temp. Aussen": "temp. aussen"}
+    assert failed == ["Temp. Vorlauf"]
+    assert publisher.error_rates == {"Temp. Aussen": 0.0, "Temp. Vorlauf": 1.0}
+
+
+def _cyclic_sendings(hthp, duration: float, **kwargs) -> List[Tuple[str, float]]:
+    """Run the cyclic sending and return the names of the sent data points and the times."""
+
+    async def run():
+        loop = asyncio.get_event_loop()
+        broker = HtRequestBroker(hthp)
+        dps = [
+            _data_point(XKNX(), broker, "Temp. Aussen", "1/2/1", cyclic_sending=True),
+            _data_point(XKNX(), broker, "Temp. Vorlauf", "1/2/2", cyclic_sending=True),
+            _data_point(
+                XKNX(),
+                broker,
+                "Temp. Ruecklauf",
+                "1/2/3",
+                cyclic_sending=True,
+                cyclic_sending_interval=dt.timedelta(seconds=0.05),
+            ),
+        ]
+        publisher = _publisher(broker, *dps, update_interval=dt.timedelta(0), **kwargs)
+        sendings = []
+        for dp in dps:
+
+            async def broadcast_value(name=dp.name):
+                sendings.append((name, loop.time() - publisher._start_time))
+
+            dp.broadcast_value = broadcast_value  # type: ignore
+        with publisher:
+            await asyncio.sleep(duration)
+        return sendings
+
+    return asyncio.run(run())
+
+
+def test_cyclic_sending(hthp):
+    sendings = _cyclic_sendings(
+        hthp, 0.13, cyclic_sending_interval=dt.timedelta(seconds=0.1)
+    )
+    assert [name for name, _ in sendings] == [
+        "Temp. Aussen",
+        "Temp. Vorlauf",
+        "Temp. Ruecklauf",
+        "Temp. Ruecklauf",
+        "Temp. Aussen",
+        "Temp. Vorlauf",
+        "Temp. Ruecklauf",
+    ]
+    assert [t for _, t in sendings] == pytest.approx(
+        [0.0, 0.0, 0.0, 0.05, 0.1, 0.1, 0.1], abs=0.02
+    )
+
+
+def test_staggered_cyclic_sending(hthp):
+    sendings = _cyclic_sendings(
+        hthp,
+        0.13,
+        cyclic_sending_interval=dt.timedelta(seconds=0.1),
+        cyclic_sending_offset=dt.timedelta(seconds=0.02),
+        stagger_cyclic_sending=True,
+    )
+    # each data point of the same interval gets its own phase within the interval
+    assert [name for name, _ in sendings] == [
+        "Temp. Aussen",
+        "Temp. Ruecklauf",
+        "Temp. Vorlauf",
+        "Temp. Ruecklauf",
+        "Temp. Aussen",
+        "Temp. Ruecklauf",
+    ]
+    assert [t for _, t in sendings] == pytest.approx(
+        [0.02, 0.02, 0.07, 0.07, 0.12, 0.12], abs=0.02
+    )
+
+
+def test_publish_batch(hthp):
+    async def run():
+        xknx = XKNX()
+        broker = HtRequestBroker(hthp)
+        dps = [
+            _data_point(
+                xknx,
+                broker,
+                name,
+                f"1/2/{i}",
+                send_on_change=True,
+                on_change_of_absolute=0.5,
+            )
+            for i, name in enumerate(
+                ("Temp. Aussen", "Temp. Vorlauf", "Temp. Ruecklauf")
+            )
+        ]
+        publisher = _publisher(broker, *dps)
+
+        async def failing_set(value):
+            raise ValueError("invalid value")
+
+        dps[1].set = failing_set  # type: ignore
+        # a failed update of one data point doesn't affect the others
+        await publisher._publish({dp.name: 20.0 for dp in dps})
+        return _sent(xknx)
+
+    telegrams = asyncio.run(run())
+    assert sorted(str(t.destination_address) for t in telegrams) == ["1/2/0", "1/2/2"]
+
+
+def test_malfunction_check_with_the_batched_query(hthp):
+    hthp.params[FAULT_PARAM] = True
+    hthp.fault_list_size = 2
+
+    async def run():
+        xknx = XKNX()
+        with HtRequestBroker(hthp) as broker:
+            dp = _data_point(xknx, broker)
+            notif = HtFaultNotification(xknx, broker, "Fault", "1/0/0", None)
+            with _publisher(broker, dp, notifications={notif.name: notif}):
+                await asyncio.sleep(0.05)
+            return notif
+
+    notif = asyncio.run(run())
+    assert hthp.calls[0] == ("fast_query", "Temp. Aussen", FAULT_PARAM)
+    assert _queried(hthp).count(FAULT_PARAM) == 1
+    assert notif.in_error
+    assert hthp.fetched == [(0, 1)]
+
+
+def _update_cycle(hthp, monkeypatch, **kwargs):
+    """Run the first update cycle of two data points (with a short retry delay)."""
+    monkeypatch.setattr(htpublisher, "QUERY_RETRY_DELAY", 0.01)
+
+    async def run():
+        xknx = XKNX()
+        with HtRequestBroker(hthp, **kwargs) as broker:
+            dps = [
+                _data_point(xknx, broker, "Temp. Aussen", "1/2/1"),
+                _data_point(xknx, broker, "Temp. Vorlauf", "1/2/2"),
+            ]
+            with _publisher(broker, *dps) as publisher:
+                await asyncio.sleep(0.1)
+            return publisher, dps
+
+    return asyncio.run(run())
+
+
+def test_retry_of_the_failed_parameters(hthp, monkeypatch):
+    hthp.params["Temp. Aussen"] = 5.0
+    hthp.failing.add("Temp. Vorlauf")
+    publisher, dps = _update_cycle(hthp, monkeypatch, failure_threshold=100)
+    # the successful parameters are published without waiting for the retries
+    assert dps[0].raw_value == 5.0
+    assert _queried(hthp)[:4] == [
+        "Temp. Aussen",
+        "Temp. Vorlauf",
+        "Temp. Aussen",
+        "Temp. Vorlauf",
+    ]
+    # only the failed parameter is retried
+    assert _queried(hthp)[4:] == ["Temp. Vorlauf"] * 4
+    assert publisher.error_rates == {"Temp. Aussen": 0.0, "Temp. Vorlauf": 1.0}
+
+
+def test_no_retry_while_the_link_is_down(hthp, monkeypatch, caplog):
+    hthp.failing.add("Temp. Vorlauf")
+    _update_cycle(hthp, monkeypatch, failure_threshold=2)
+    # the link is down after the (failed) fast query of the first retry
+    messages = [record.getMessage() for record in caplog.records]
+    assert "Query of ['Temp. Vorlauf'] failed, retry #1 in 0.0 s" in messages
+    assert "Serial link to the heat pump is down, no retry of ['Temp. Vorlauf']" in (
+        messages
+    )
+    assert not any("retry #2" in msg or "after 2 retries" in msg for msg in messages)
+
+
+def test_auto_update_interval(hthp):
+    async def run():
+        broker = HtRequestBroker(hthp)
+        dp = _data_point(XKNX(), broker)
+        fixed = _data_point(
+            XKNX(), broker, "Temp. Vorlauf", "1/2/4", update_interval=dt.timedelta(10)
+        )
+        publisher = _publisher(
+            broker, dp, fixed, update_interval="auto", target_utilization=0.5
+        )
+        schedule = Schedule()
+        schedule.add(dp.name, 30.0, 0.0)
+        schedule.add(fixed.name, 30.0, 0.0)
+        intervals = []
+        for cycle_time in (2.0, 2.0, 2.0, 2.0, 4.0, 2.1, 2.2):
+            publisher._cycle_times.append(cycle_time)
+            interval = publisher._tune_update_interval(
+                schedule, publisher._update_interval
+            )
+            intervals.append(interval.total_seconds())
+        assert schedule.interval(dp.name) == 8.0
+        assert schedule.interval(fixed.name) == 30.0
+        return intervals
+
+    # tuned to the 95th percentile of the cycle time (after a minimum number of samples)
+    assert asyncio.run(run()) == [60.0, 60.0, 60.0, 60.0, 8.0, 8.0, 8.0]
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for the request broker of the heat pump. """
+
+import asyncio
+
+import pytest
+
+from htknx import htrequestbroker
+from htknx.htrequestbroker import HtLinkDownError, HtRequestBroker, Priority
+
+
+async def _queue_then_start(broker: HtRequestBroker, *coros):
+    """Queue the requests while the broker isn't running yet, then start it."""
+    tasks = []
+    for coro in coros:
+        tasks.append(asyncio.ensure_future(coro))
+        await asyncio.sleep(0)  # let the request be queued
+    with broker:
+        return await asyncio.gather(*tasks)
+
+
+def test_priority_ordering(hthp):
+    async def run():
+        broker = HtRequestBroker(hthp)
+        results = await _queue_then_start(
+            broker,
+            broker.get_param_async("A", Priority.PERIODIC),
+            broker.get_param_async("B", Priority.FAULT_CHECK),
+            broker.get_param_async("C", Priority.GROUP_READ),
+            broker.set_param_async("D", 1),
+            broker.get_param_async("E", Priority.PERIODIC),
+        )
+        return broker, results
+
+    broker, results = asyncio.run(run())
+    assert results == ["a", "b", "c", 1, "e"]
+    # higher priority first, in the order of submission within the same priority
+    assert hthp.calls == [("set", "D", 1), "C", "B", "A", "E"]
+    assert broker.stats["requests"] == {
+        "USER_WRITE": 1,
+        "GROUP_READ": 1,
+        "FAULT_CHECK": 1,
+        "PERIODIC": 2,
+    }
+
+
+def test_coalescing(hthp):
+    async def run():
+        broker = HtRequestBroker(hthp)
+        results = await _queue_then_start(
+            broker,
+            broker.get_param_async("A"),
+            broker.get_param_async("A"),
+            broker.get_param_async("B"),
+        )
+        return broker, results
+
+    broker, results = asyncio.run(run())
+    assert results == ["a", "a", "b"]
+    assert hthp.calls == ["A", "B"]
+    assert broker.stats["coalesced"] == 1
+
+
+def test_writes_are_not_coalesced(hthp):
+    async def run():
+        broker = HtRequestBroker(hthp)
+        await _queue_then_start(
+            broker, broker.set_param_async("A", 1), broker.set_param_async("A", 1)
+        )
+
+    asyncio.run(run())
+    assert hthp.calls == [("set", "A", 1), ("set", "A", 1)]
+
+
+def test_priority_bump(hthp):
+    async def run():
+        broker = HtRequestBroker(hthp)
+        results = await _queue_then_start(
+            broker,
+            broker.get_param_async("A", Priority.PERIODIC),
+            broker.get_param_async("B", Priority.PERIODIC),
+            # the queued periodic request of 'B' is raised to the priority of the GROUP READ
+            broker.get_param_async("B", Priority.GROUP_READ),
+        )
+        return broker, results
+
+    broker, results = asyncio.run(run())
+    assert results == ["a", "b", "b"]
+    # executed only once, but before 'A'
+    assert hthp.calls == ["B", "A"]
+    assert broker.stats["coalesced"] == 1
+    assert broker.stats["requests"]["GROUP_READ"] == 1
+    assert broker.stats["requests"]["PERIODIC"] == 1
+
+
+def test_session_login_on_demand(hthp):
+    async def run():
+        with HtRequestBroker(hthp, session_timeout=30.0) as broker:
+            await broker.get_param_async("A")
+            await broker.get_param_async("B")
+            # a failed request is retried once after a new login
+            hthp.failing.add("C")
+            with pytest.raises(IOError):
+                await broker.get_param_async("C")
+        return broker
+
+    broker = asyncio.run(run())
+    assert hthp.calls == ["login", "A", "B", "C", "login", "C"]
+    assert broker.stats["logins"] == 2
+    assert broker.stats["relogins"] == 1
+
+
+def test_circuit_breaker(hthp, monkeypatch):
+    monkeypatch.setattr(htrequestbroker, "DEFAULT_RECONNECT_DELAY_MIN", 0.01)
+
+    async def run():
+        hthp.failing.add("A")
+        with HtRequestBroker(hthp, failure_threshold=2) as broker:
+            for _ in range(2):
+                with pytest.raises(IOError):
+                    await broker.get_param_async("A")
+            assert not broker.link_up
+            # requests are rejected while the link is down
+            with pytest.raises(HtLinkDownError):
+                await broker.get_param_async("B")
+            await asyncio.sleep(0.05)
+            assert broker.link_up
+            assert await broker.get_param_async("B") == "b"
+        return broker
+
+    broker = asyncio.run(run())
+    assert "reconnect" in hthp.calls
+    assert broker.stats["reconnects"] == 1
+    assert broker.stats["rejected"] == 1
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for the scheduling helpers. """
+
+import pytest
+
+from htknx.scheduler import Schedule, next_deadline
+
+
+@pytest.mark.parametrize(
+    "deadline, interval, now, expected",
+    [
+        (10.0, 5.0, 9.0, (15.0, 0)),  # called before the deadline
+        (10.0, 5.0, 11.0, (15.0, 0)),  # called shortly after the deadline
+        (10.0, 5.0, 19.0, (15.0, 0)),  # late, but less than one interval
+        (10.0, 5.0, 20.0, (20.0, 1)),  # one deadline missed
+        (10.0, 5.0, 27.0, (25.0, 2)),  # two deadlines missed
+    ],
+)
+def test_next_deadline(deadline, interval, now, expected):
+    assert next_deadline(deadline, interval, now) == expected
+
+
+class TestSchedule:
+    def test_empty(self):
+        schedule = Schedule()
+        assert len(schedule) == 0
+        assert schedule.next_deadline() is None
+        assert schedule.due(100.0) == []
+
+    def test_add(self):
+        schedule = Schedule()
+        schedule.add("a", 10.0, 0.0)
+        schedule.add("b", 30.0, 5.0)
+        assert len(schedule) == 2
+        assert "a" in schedule and "c" not in schedule
+        assert schedule.interval("b") == 30.0
+        assert schedule.next_deadline() == 0.0
+        assert schedule.due(0.0) == ["a"]
+        assert sorted(schedule.due(5.0)) == ["a", "b"]
+
+    def test_add_invalid_interval(self):
+        with pytest.raises(AssertionError):
+            Schedule().add("a", 0.0, 0.0)
+
+    def test_reschedule(self):
+        schedule = Schedule()
+        schedule.add("a", 10.0, 0.0)
+        schedule.add("b", 30.0, 0.0)
+        for key in schedule.due(1.0):
+            assert schedule.reschedule(key, 1.0) == 0
+        assert schedule.due(1.0) == []
+        assert schedule.next_deadline() == 10.0
+        assert schedule.due(10.0) == ["a"]
+        assert schedule.due(30.0) == ["a", "b"]
+
+    def test_reschedule_missed(self):
+        schedule = Schedule()
+        schedule.add("a", 10.0, 0.0)
+        assert schedule.reschedule("a", 35.0) == 2
+        assert schedule.missed == 2
+        assert schedule.next_deadline() == 30.0
+
+    def test_set_interval(self):
+        schedule = Schedule()
+        schedule.add("a", 10.0, 0.0)
+        schedule.set_interval("a", 20.0)
+        # effective with the next rescheduling
+        assert schedule.next_deadline() == 0.0
+        schedule.reschedule("a", 0.0)
+        assert schedule.next_deadline() == 20.0
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for the persistent snapshot of the data point states. """
+
+import asyncio
+import datetime as dt
+import os
+
+from xknx import XKNX
+
+from htknx.htdatapoint import HtDataPoint
+from htknx.htrequestbroker import HtRequestBroker
+from htknx.state import StateStore
+
+
+def _data_point(hthp) -> HtDataPoint:
+    return HtDataPoint(
+        XKNX(), HtRequestBroker(hthp), "Temp. Aussen", "1/2/3", "temperature"
+    )
+
+
+def test_round_trip(hthp, tmp_path):
+    filename = str(tmp_path / "state.json")
+
+    async def save():
+        dp = _data_point(hthp)
+        dp.raw_value = 12.5
+        dp.touch()
+        dp.last_sent_value = 12.0
+        dp.last_sent_at = asyncio.get_event_loop().time()
+        StateStore(filename, {dp.name: dp}, dt.timedelta(0)).save()
+
+    async def load():
+        dp = _data_point(hthp)
+        StateStore(filename, {dp.name: dp, "unknown": dp}, dt.timedelta(0)).load()
+        return dp
+
+    asyncio.run(save())
+    dp = asyncio.run(load())
+    assert dp.raw_value == 12.5
+    assert dp.param_value.payload == dp.param_value.to_knx(12.5)
+    assert dp.last_sent_value == 12.0
+    assert dp.last_sent_payload == dp.param_value.to_knx(12.0)
+    assert dp.updated_at is not None and dp.last_sent_at is not None
+
+
+def test_missing_or_invalid_state_file(hthp, tmp_path):
+    filename = tmp_path / "state.json"
+
+    async def load():
+        dp = _data_point(hthp)
+        StateStore(str(filename), {dp.name: dp}, dt.timedelta(0)).load()
+        return dp
+
+    assert asyncio.run(load()).raw_value is None
+    filename.write_text("no JSON")
+    assert asyncio.run(load()).raw_value is None
+
+
+def test_save_only_on_change(hthp, tmp_path):
+    filename = str(tmp_path / "state.json")
+
+    async def run():
+        dp = _data_point(hthp)
+        store = StateStore(filename, {dp.name: dp}, dt.timedelta(0))
+        dp.raw_value = 12.5
+        dp.touch()
+        store.save()
+        os.utime(filename, ns=(0, 0))
+        # a newer update time alone isn't a change
+        await asyncio.sleep(0.01)
+        dp.touch()
+        store.save()
+        assert os.stat(filename).st_mtime_ns == 0
+        dp.raw_value = 13.0
+        store.save()
+        assert os.stat(filename).st_mtime_ns != 0
+
+    asyncio.run(run())
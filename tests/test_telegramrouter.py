@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  htknx - Heliotherm heat pump KNX gateway
+#  Copyright (C) 2021  Daniel Strigl
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for the routing of KNX telegrams to the devices of the gateway. """
+
+import asyncio
+from typing import List
+
+from xknx.telegram import GroupAddress, IndividualAddress, Telegram, TelegramDirection
+from xknx.telegram.apci import GroupValueRead
+
+from htknx.telegramrouter import TelegramRouter
+
+
+class RecordingDevice:
+    """Minimal stand-in for a :class:`~xknx.devices.Device` which records the telegrams."""
+
+    def __init__(self) -> None:
+        self.telegrams: List[Telegram] = []
+
+    async def process(self, telegram: Telegram) -> None:
+        self.telegrams.append(telegram)
+
+
+def _telegram(
+    address, direction: TelegramDirection = TelegramDirection.INCOMING
+) -> Telegram:
+    return Telegram(
+        destination_address=address, direction=direction, payload=GroupValueRead()
+    )
+
+
+def test_routing():
+    router = TelegramRouter()
+    dev1, dev2 = RecordingDevice(), RecordingDevice()
+    router.route(GroupAddress("1/2/3"), dev1)  # type: ignore
+    router.route(GroupAddress("1/2/3"), dev2)  # type: ignore
+    router.route(GroupAddress("1/2/3"), dev1)  # type: ignore
+    router.route(GroupAddress("1/2/4"), dev2)  # type: ignore
+    assert list(router.devices_by_group_address(GroupAddress("1/2/3"))) == [
+        dev1,
+        dev2,
+    ]
+
+    async def run():
+        for address in ("1/2/3", "1/2/4", "1/2/5", "2/0/0"):
+            await router.process(_telegram(GroupAddress(address)))
+        await router.process(_telegram(IndividualAddress("1.1.1")))
+
+    asyncio.run(run())
+    assert [str(t.destination_address) for t in dev1.telegrams] == ["1/2/3"]
+    assert [str(t.destination_address) for t in dev2.telegrams] == ["1/2/3", "1/2/4"]
+    assert router.stats == {"dispatched": 2, "filtered": 3}
+
+
+def test_outgoing_telegrams_are_not_counted():
+    router = TelegramRouter()
+    dev = RecordingDevice()
+    router.route(GroupAddress("1/2/3"), dev)  # type: ignore
+
+    async def run():
+        for address in ("1/2/3", "1/2/4"):
+            await router.process(
+                _telegram(GroupAddress(address), TelegramDirection.OUTGOING)
+            )
+
+    asyncio.run(run())
+    # still passed to the device (to update its state)
+    assert len(dev.telegrams) == 1
+    assert router.stats == {"dispatched": 0, "filtered": 0}